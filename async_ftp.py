@@ -0,0 +1,194 @@
+import asyncio
+import re
+from ftplib import error_perm, error_proto, error_reply, error_temp
+
+# Минимальный асинхронный FTP-клиент на asyncio (только пассивный режим).
+# Имена методов и исключения совпадают с ftplib, поэтому обработка ошибок
+# общая с синхронным кодом
+
+CRLF = '\r\n'
+PASV_RE = re.compile(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)')
+
+class AsyncFTP:
+    def __init__(self, encoding='utf-8', timeout=None):
+        self.encoding = encoding
+        self.timeout = timeout
+        self.host = None
+        self.port = None
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, host, port=21):
+        self.host = host
+        self.port = port
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        return await self.getresp()
+
+    async def login(self, user='anonymous', passwd=''):
+        resp = await self.sendcmd(f'USER {user}')
+        if resp[0] == '3':
+            resp = await self.sendcmd(f'PASS {passwd}')
+        if resp[0] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def getline(self):
+        line = await self._reader.readline()
+        if not line:
+            raise EOFError
+        return line.decode(self.encoding).rstrip('\r\n')
+
+    async def getmultiline(self):
+        # Многострочный ответ: "123-..." до строки "123 ..."
+        line = await self.getline()
+        if line[3:4] == '-':
+            code = line[:3]
+            while True:
+                next_line = await self.getline()
+                line = f"{line}\n{next_line}"
+                if next_line[:3] == code and next_line[3:4] != '-':
+                    break
+        return line
+
+    async def getresp(self):
+        resp = await self.getmultiline()
+        code = resp[:1]
+        if code in ('1', '2', '3'):
+            return resp
+        if code == '4':
+            raise error_temp(resp)
+        if code == '5':
+            raise error_perm(resp)
+        raise error_proto(resp)
+
+    async def voidresp(self):
+        resp = await self.getresp()
+        if resp[:1] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def sendcmd(self, cmd):
+        self._writer.write(f"{cmd}{CRLF}".encode(self.encoding))
+        await self._writer.drain()
+        return await self.getresp()
+
+    async def voidcmd(self, cmd):
+        resp = await self.sendcmd(cmd)
+        if resp[:1] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def transfercmd(self, cmd):
+        # Открываем соединение данных в пассивном режиме и отправляем команду передачи.
+        # Как и ftplib, адрес из ответа PASV игнорируем и подключаемся к хосту управляющего соединения
+        resp = await self.sendcmd('PASV')
+        if resp[:3] != '227':
+            raise error_reply(resp)
+        match = PASV_RE.search(resp)
+        if not match:
+            raise error_proto(resp)
+        numbers = [int(n) for n in match.groups()]
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, (numbers[4] << 8) + numbers[5]), self.timeout)
+        try:
+            resp = await self.sendcmd(cmd)
+            if resp[0] == '2':
+                resp = await self.getresp()
+            if resp[0] != '1':
+                raise error_reply(resp)
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def retrbinary(self, cmd, callback, blocksize=8192):
+        await self.voidcmd('TYPE I')
+        reader, writer = await self.transfercmd(cmd)
+        try:
+            while True:
+                data = await reader.read(blocksize)
+                if not data:
+                    break
+                callback(data)
+        finally:
+            writer.close()
+        return await self.voidresp()
+
+    async def storbinary(self, cmd, fp, blocksize=8192, callback=None):
+        await self.voidcmd('TYPE I')
+        reader, writer = await self.transfercmd(cmd)
+        try:
+            while True:
+                buf = fp.read(blocksize)
+                if not buf:
+                    break
+                writer.write(buf)
+                await writer.drain()
+                if callback is not None:
+                    callback(buf)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        return await self.voidresp()
+
+    async def retrlines(self, cmd):
+        # В отличие от ftplib, возвращаем список строк вместо вызова callback
+        await self.sendcmd('TYPE A')
+        reader, writer = await self.transfercmd(cmd)
+        lines = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                lines.append(line.decode(self.encoding).rstrip('\r\n'))
+        finally:
+            writer.close()
+        await self.voidresp()
+        return lines
+
+    async def mlsd(self, path=''):
+        # Возвращаем [(имя, {факт: значение})], как ftplib.FTP.mlsd
+        lines = await self.retrlines(f'MLSD {path}' if path else 'MLSD')
+        entries = []
+        for line in lines:
+            facts_found, _, name = line.rstrip(CRLF).partition(' ')
+            entry = {}
+            for fact in facts_found[:-1].split(';'):
+                key, _, value = fact.partition('=')
+                entry[key.lower()] = value
+            entries.append((name, entry))
+        return entries
+
+    async def size(self, filename):
+        resp = await self.sendcmd(f'SIZE {filename}')
+        if resp[:3] == '213':
+            return int(resp[3:].strip())
+        return None
+
+    async def rename(self, fromname, toname):
+        resp = await self.sendcmd(f'RNFR {fromname}')
+        if resp[0] != '3':
+            raise error_reply(resp)
+        return await self.voidcmd(f'RNTO {toname}')
+
+    async def delete(self, filename):
+        resp = await self.sendcmd(f'DELE {filename}')
+        if resp[:3] not in ('250', '200'):
+            raise error_reply(resp)
+        return resp
+
+    async def mkd(self, dirname):
+        return await self.voidcmd(f'MKD {dirname}')
+
+    async def quit(self):
+        try:
+            return await self.voidcmd('QUIT')
+        finally:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
@@ -0,0 +1,271 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Замеры производительности обоих скриптов на синтетических данных.
+# rename_png_files.py: генерируется коллекция ES (media/<система>/<категория>/<имя>.png)
+# и плейлисты .lpl, copy_png_files замеряется целиком с холодным и теплым кэшем.
+# delete_ftp_lpl_processor.py: генерируется дерево RetroArch на локальном FTP-сервере
+# (local_ftp_server.py) с задержкой на каждую команду, run() замеряется для выбранных движков.
+# Результат - JSON для сравнения между версиями
+
+ES_CATEGORIES = ('art', 'boxart', 'cartridge', 'screenshot', 'video')
+RA_CATEGORIES = ('Named_Boxarts', 'Named_Snaps', 'Named_Titles')
+REGIONS = ('USA', 'Europe', 'Japan', 'World', 'USA, Europe')
+WORDS = ('Super', 'Mega', 'Adventure', 'Quest', 'Racing', 'Fighter', 'Legend', 'Island', 'Star', 'Dragon',
+         'Soccer', 'Puzzle', 'Ninja', 'Castle', 'Space', 'Turbo', 'World', 'Hero', 'Dungeon', 'Kart')
+
+def game_names(count, rng):
+    # Уникальные имена в стиле No-Intro: "Dragon Quest 12 (USA)", часть с точкой и апострофом
+    names = []
+    for i in range(count):
+        title = ' '.join(rng.sample(WORDS, rng.randint(1, 3)))
+        if i % 17 == 0:
+            title += "'s Revenge"
+        if i % 23 == 0:
+            title = f"{title}. Part II"
+        names.append(f"{title} {i} ({rng.choice(REGIONS)})")
+    return names
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def split_by_system(entries, systems):
+    # Равномерно распределяем записи по системам
+    return [(f"sys{index:02d}", f"Synthetic - System {index:02d}", entries * (index + 1) // systems - entries * index // systems)
+            for index in range(systems)]
+
+def generate_es_collection(root, entries, systems, found_ratio, seed):
+    # Коллекция ES: каталог поиска media/ с подкаталогами систем и плейлисты в playlists/.
+    # Для доли found_ratio записей создаются картинки в случайных категориях, включая
+    # игнорируемую категорию video и лишние файлы с тем же префиксом
+    rng = random.Random(seed)
+    search_dir = os.path.join(root, 'media')
+    playlist_dir = os.path.join(root, 'playlists')
+    os.makedirs(playlist_dir, exist_ok=True)
+    base = '/storage/roms'
+    playlists = []
+    images = 0
+    for system, db_name, count in split_by_system(entries, systems):
+        items = []
+        for name in game_names(count, rng):
+            if rng.random() < 0.3:
+                path = f"{base}/{system}/{name}.zip#{name}.bin"
+            else:
+                path = f"{base}/{system}/{name}.zip"
+            items.append({'path': path, 'label': name, 'core_path': 'DETECT', 'core_name': 'DETECT',
+                          'crc32': '00000000|crc', 'db_name': f"{db_name}.lpl"})
+            if rng.random() >= found_ratio:
+                continue
+            for category in rng.sample(ES_CATEGORIES, rng.randint(1, len(ES_CATEGORIES))):
+                write_file(os.path.join(search_dir, system, category, f"{name}.png"), name.encode('utf-8'))
+                images += 1
+                if rng.random() < 0.1:
+                    write_file(os.path.join(search_dir, system, category, f"{name} (Alt).png"), b'alt')
+                    images += 1
+        playlist = os.path.join(playlist_dir, f"{db_name}.lpl")
+        with open(playlist, 'w', encoding='utf-8') as f:
+            json.dump({'version': '1.5', 'default_core_path': '', 'default_core_name': '',
+                       'base_content_directory': base, 'label_display_mode': 0, 'items': items}, f, indent=2)
+        playlists.append(playlist)
+    return search_dir, playlists, images
+
+def generate_ftp_tree(root, entries, systems, rom_size, seed):
+    # Дерево RetroArch на консоли: ROM в /roms/<система>, миниатюры в /retroarch/thumbnails/<база>,
+    # плейлист /retroarch/playlists/delete.lpl. В каждом каталоге миниатюр есть файлы,
+    # которые не должны быть перемещены
+    rng = random.Random(seed)
+    items = []
+    for system, db_name, count in split_by_system(entries, systems):
+        for name in game_names(count, rng):
+            write_file(os.path.join(root, 'roms', system, f"{name}.zip"), os.urandom(rom_size))
+            for category in RA_CATEGORIES:
+                if rng.random() < 0.7:
+                    write_file(os.path.join(root, 'retroarch', 'thumbnails', db_name, category, f"{name}.png"), b'png')
+            items.append({'path': f"/roms/{system}/{name}.zip#{name}.bin", 'label': name, 'core_path': 'DETECT',
+                          'core_name': 'DETECT', 'crc32': 'DETECT', 'db_name': f"{db_name}.lpl"})
+        for category in RA_CATEGORIES:
+            write_file(os.path.join(root, 'retroarch', 'thumbnails', db_name, category, 'Keep Me (USA).png'), b'png')
+    write_file(os.path.join(root, 'retroarch', 'playlists', 'delete.lpl'),
+               json.dumps({'version': '1.5', 'base_content_directory': '/roms', 'items': items}, indent=2).encode('utf-8'))
+
+@contextlib.contextmanager
+def quiet(enabled):
+    # Подавляем консольный вывод скриптов, чтобы он не влиял на замер
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def bench_copy(work_dir, args):
+    import rename_png_files
+
+    search_dir, playlists, images = generate_es_collection(os.path.join(work_dir, 'es'), args.entries, args.systems,
+                                                           args.found_ratio, args.seed)
+    logs = os.path.join(work_dir, 'copy_logs')
+    os.makedirs(logs, exist_ok=True)
+    target_dir = os.path.join(search_dir, 'retroarch')
+
+    # cold - без кэша сканирования и с пустым каталогом назначения,
+    # warm - кэш сканирования есть, файлы копируются заново,
+    # incremental - кэш есть, неизмененные файлы пропускаются
+    scenarios = (
+        ('cold', {'rebuild_cache': True}),
+        ('warm', {}),
+        ('incremental', {'incremental': True})
+    )
+    results = []
+    for scenario, options in scenarios:
+        if scenario != 'incremental':
+            shutil.rmtree(target_dir, ignore_errors=True)
+        total = rename_png_files.new_stats()
+        start = time.perf_counter()
+        with quiet(not args.verbose):
+            for playlist in playlists:
+                log_name = os.path.splitext(os.path.basename(playlist))[0]
+                stats = rename_png_files.copy_png_files(
+                    playlist, search_dir,
+                    os.path.join(logs, f"{scenario}_{log_name}.txt"),
+                    os.path.join(logs, f"{scenario}_{log_name}_error.txt"),
+                    os.path.join(logs, f"{scenario}_{log_name}_not_found.txt"),
+                    jobs=args.jobs, link_mode=args.link_mode, match=args.match, **options)
+                for key, value in stats.items():
+                    total[key] += value
+            rename_png_files.close_logging()
+        elapsed = time.perf_counter() - start
+        results.append({
+            'benchmark': 'copy_png_files',
+            'scenario': scenario,
+            'entries': args.entries,
+            'systems': args.systems,
+            'images': images,
+            'jobs': args.jobs,
+            'link_mode': args.link_mode,
+            'match': args.match,
+            'elapsed': elapsed,
+            'entries_per_sec': args.entries / elapsed if elapsed > 0 else 0.0,
+            'stats': total
+        })
+        print(f"copy_png_files [{scenario}]: {elapsed:.2f} сек, найдено {total['files_found']}, ошибок {total['errors']}")
+    return results
+
+def bench_delete(work_dir, args):
+    from local_ftp_server import LocalFTPServer
+
+    import delete_ftp_lpl_processor as delete_processor
+
+    logs = os.path.join(work_dir, 'delete_logs')
+    delete_processor.setup_logging(logs)
+
+    results = []
+    for engine in args.engines:
+        for dry_run in ((True, False) if args.include_dry_run else (False,)):
+            ftp_root = os.path.join(work_dir, 'ftp')
+            shutil.rmtree(ftp_root, ignore_errors=True)
+            generate_ftp_tree(ftp_root, args.ftp_entries, args.systems, args.rom_size, args.seed)
+            journal_file = os.path.join(logs, f"journal_{engine}_{'dry' if dry_run else 'move'}.jsonl")
+
+            server = LocalFTPServer(ftp_root, latency=args.latency, allow_rename=not args.no_rename).start()
+            try:
+                with quiet(not args.verbose):
+                    config = delete_processor.get_config()
+                    config.update(ftp_host='127.0.0.1', ftp_port=server.port, dry_run=dry_run, engine=engine,
+                                  workers=args.ftp_workers, journal_file=journal_file)
+                    start = time.perf_counter()
+                    records = delete_processor.run(config)
+                    elapsed = time.perf_counter() - start
+            finally:
+                server.stop()
+
+            record = records[0] if records else None
+            if record is None:
+                print(f"delete [{engine}{', dry-run' if dry_run else ''}]: ошибка, см. {os.path.join(logs, 'error.log')}")
+            else:
+                print(f"delete [{engine}{', dry-run' if dry_run else ''}]: {elapsed:.2f} сек, "
+                      f"ROM {record['totals']['moved_roms']}, ошибок {record['totals']['error_count']}")
+            results.append({
+                'benchmark': 'delete_ftp_lpl_processor',
+                'scenario': f"{engine}-{'dry-run' if dry_run else 'move'}",
+                'entries': args.ftp_entries,
+                'systems': args.systems,
+                'engine': engine,
+                'workers': args.ftp_workers,
+                'latency': args.latency,
+                'rename': not args.no_rename,
+                'elapsed': elapsed,
+                'entries_per_sec': args.ftp_entries / elapsed if elapsed > 0 else 0.0,
+                'server_commands': dict(sorted(server.commands.items())),
+                'run': record
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности на синтетических коллекциях")
+    parser.add_argument("--entries", type=int, default=1000, help="Количество записей для copy_png_files (по умолчанию 1000)")
+    parser.add_argument("--systems", type=int, default=4, help="Количество систем (плейлистов)")
+    parser.add_argument("--found_ratio", type=float, default=0.9, help="Доля записей, для которых есть картинки")
+    parser.add_argument("--jobs", type=int, default=4, help="Потоки копирования copy_png_files")
+    parser.add_argument("--link_mode", default='copy', help="Способ размещения файлов copy_png_files")
+    parser.add_argument("--match", default='prefix', help="Режим сопоставления картинок copy_png_files")
+    parser.add_argument("--ftp_entries", type=int, default=200, help="Количество записей в delete.lpl (по умолчанию 200)")
+    parser.add_argument("--ftp_workers", type=int, default=4, help="Количество FTP-соединений")
+    parser.add_argument("--latency", type=float, default=0.002, help="Задержка на каждую FTP-команду, сек")
+    parser.add_argument("--rom_size", type=int, default=4096, help="Размер синтетического ROM, байт")
+    parser.add_argument("--engines", default='sync,async', help="Движки delete_ftp_lpl_processor через запятую")
+    parser.add_argument("--no_rename", action="store_true", help="Сервер отклоняет RNFR/RNTO (перемещение копированием)")
+    parser.add_argument("--include_dry_run", action="store_true", help="Дополнительно замерить dry-run")
+    parser.add_argument("--only", choices=('copy', 'delete'), help="Запустить только один набор замеров")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора данных")
+    parser.add_argument("--work_dir", help="Каталог для данных (по умолчанию временный, удаляется после запуска)")
+    parser.add_argument("--output", help="Файл для результатов JSON (по умолчанию вывод в консоль)")
+    parser.add_argument("--verbose", action="store_true", help="Не подавлять вывод скриптов")
+    args = parser.parse_args()
+    args.jobs = max(1, args.jobs)
+    args.ftp_workers = max(1, args.ftp_workers)
+    args.engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+
+    # Скрипты импортируются из каталога benchmark.py независимо от текущего каталога
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='retroarch_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    try:
+        if args.only in (None, 'copy'):
+            results.extend(bench_copy(work_dir, args))
+        if args.only in (None, 'delete'):
+            results.extend(bench_delete(work_dir, args))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'results': results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Результаты записаны в {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
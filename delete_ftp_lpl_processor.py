@@ -1,12 +1,25 @@
+import argparse
+import asyncio
 import json
+import math
 import os
 import logging
-from ftplib import FTP
+import multiprocessing
+import queue
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from ftplib import FTP, error_perm, error_temp, print_line
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 import time
 import sys
 from datetime import datetime
 
+from async_ftp import AsyncFTP
+from lpl_reader import parse_entry
+
 # ANSI-цвета
 class Colors:
     RED = '\033[91m'
@@ -25,15 +38,6 @@ if sys.platform == 'win32':
         class Colors:
             RED = GREEN = YELLOW = BLUE = RESET = ''
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('general.log', encoding='utf-8'),
-    ]
-)
-
 class ColorConsoleHandler(logging.StreamHandler):
     def emit(self, record):
         try:
@@ -53,18 +57,44 @@ console_logger = logging.getLogger('console')
 console_handler = ColorConsoleHandler()
 console_handler.setFormatter(logging.Formatter('%(message)s'))
 console_logger.addHandler(console_handler)
+console_logger.setLevel(logging.INFO)
 
 error_logger = logging.getLogger('error_logger')
-error_handler = logging.FileHandler('error.log', encoding='utf-8')
-error_handler.setLevel(logging.ERROR)
-error_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-error_logger.addHandler(error_handler)
-
 processed_logger = logging.getLogger('processed_logger')
-processed_handler = logging.FileHandler('processed.log', encoding='utf-8')
-processed_handler.setLevel(logging.INFO)
-processed_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-processed_logger.addHandler(processed_handler)
+
+def setup_logging(log_dir='.'):
+    # Файлы general.log, error.log и processed.log открываются при запуске, а не при импорте модуля.
+    # Повторный вызов закрывает прежние файлы и переносит логи в log_dir
+    os.makedirs(log_dir, exist_ok=True)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    for logger, file_name, level, log_format in (
+            (root_logger, 'general.log', logging.NOTSET, '%(asctime)s - %(levelname)s - %(message)s'),
+            (error_logger, 'error.log', logging.ERROR, '%(asctime)s - %(levelname)s - %(message)s'),
+            (processed_logger, 'processed.log', logging.INFO, '%(asctime)s - %(message)s')):
+        for handler in [h for h in logger.handlers if isinstance(h, logging.FileHandler)]:
+            logger.removeHandler(handler)
+            handler.close()
+        handler = logging.FileHandler(os.path.join(log_dir, file_name), encoding='utf-8')
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter(log_format))
+        logger.addHandler(handler)
+
+MOVE_METHOD_NAMES = {
+    'rename': 'RNFR/RNTO',
+    'copy': 'RETR/STOR',
+    'dry-run': 'DRY-RUN',
+    'journal': 'из журнала'
+}
+
+# Размер блока передачи и порог, после которого буфер передачи переносится на диск
+BLOCK_SIZE = 64 * 1024
+SPOOL_THRESHOLD = 8 * 1024 * 1024
+
+# Журнал выполненных перемещений для продолжения прерванного запуска
+JOURNAL_FILE = 'delete_journal.jsonl'
+
+DELETE_PLAYLIST = '/retroarch/playlists/delete.lpl'
 
 def get_config():
     return {
@@ -72,189 +102,1479 @@ def get_config():
         "ftp_port": 5000,
         "ftp_user": "anonymous",
         "ftp_pass": "anonymous",
-        "dry_run": True
+        "dry_run": True,
+        "workers": 4,
+        "block_size": BLOCK_SIZE,
+        "spool_threshold": SPOOL_THRESHOLD,
+        "journal_file": JOURNAL_FILE,
+        "engine": "sync",
+        "stats_json": None,
+        # ftp - работа с консолью по FTP, local - с SD-картой, смонтированной в local_root
+        "backend": "ftp",
+        "local_root": "",
+        "playlists": [DELETE_PLAYLIST],
+        # Каталог логов пакетного режима: <log_dir>/<устройство>/general.log, error.log, processed.log
+        "log_dir": "logs"
     }
 
-def ftp_connect():
-    config = get_config()
-    ftp = FTP()
+def target_name(config):
+    # Куда подключается скрипт: для журнала, логов и статистики
+    if config.get('backend', 'ftp') == 'local':
+        return os.path.abspath(config['local_root'])
+    return f"{config['ftp_host']}:{config['ftp_port']}"
+
+# === Статистика FTP-команд ===
+
+class CommandStats:
+    # Время выполнения и объем данных по каждому типу FTP-команд, общие для всех соединений
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._bytes = {}
+
+    def record(self, command, elapsed, size=0):
+        with self._lock:
+            self._latencies.setdefault(command, []).append(elapsed)
+            self._bytes[command] = self._bytes.get(command, 0) + size
+
+    def reset(self):
+        with self._lock:
+            self._latencies = {}
+            self._bytes = {}
+
+    @contextmanager
+    def measure(self, command):
+        # Счетчик байт заполняет вызывающий код: counter[0] += len(data)
+        counter = [0]
+        start = time.perf_counter()
+        try:
+            yield counter
+        finally:
+            self.record(command, time.perf_counter() - start, counter[0])
+
+    def report(self):
+        with self._lock:
+            items = [(command, sorted(latencies), self._bytes[command]) for command, latencies in self._latencies.items()]
+        report = {}
+        for command, latencies, size in sorted(items):
+            total = sum(latencies)
+            report[command] = {
+                'count': len(latencies),
+                'total': total,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'bytes': size,
+                'bytes_per_sec': size / total if size and total > 0 else 0.0
+            }
+        return report
+
+def percentile(sorted_values, percent):
+    # Процентиль по ближайшему рангу
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def command_name(cmd):
+    return cmd.split(' ', 1)[0].upper()
+
+class InstrumentedFTP(FTP):
+    # ftplib.FTP с замером времени и объема передачи команд, используемых скриптом.
+    # ftplib.FTP.mlsd вызывает retrlines, поэтому MLSD учитывается отдельной строкой без своей обертки
+    def __init__(self, stats):
+        super().__init__()
+        self.stats = stats
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        with self.stats.measure(command_name(cmd)) as counter:
+            def counting(data):
+                counter[0] += len(data)
+                callback(data)
+            return super().retrbinary(cmd, counting, blocksize, rest)
+
+    def storbinary(self, cmd, fp, blocksize=8192, callback=None, rest=None):
+        with self.stats.measure(command_name(cmd)) as counter:
+            def counting(data):
+                counter[0] += len(data)
+                if callback is not None:
+                    callback(data)
+            return super().storbinary(cmd, fp, blocksize, counting, rest)
+
+    def retrlines(self, cmd, callback=None):
+        callback = callback or print_line
+        with self.stats.measure(command_name(cmd)) as counter:
+            def counting(line):
+                counter[0] += len(line) + 2
+                callback(line)
+            return super().retrlines(cmd, counting)
+
+    def size(self, filename):
+        with self.stats.measure('SIZE'):
+            return super().size(filename)
+
+    def mkd(self, dirname):
+        with self.stats.measure('MKD'):
+            return super().mkd(dirname)
+
+    def delete(self, filename):
+        with self.stats.measure('DELE'):
+            return super().delete(filename)
+
+    def rename(self, fromname, toname):
+        with self.stats.measure('RNFR/RNTO'):
+            return super().rename(fromname, toname)
+
+def print_command_stats(report):
+    if not report:
+        return
+    console_logger.info("FTP-команды:")
+    for command, row in report.items():
+        line = (f"  {command}: {row['count']} шт., всего {row['total']:.2f} сек, "
+                f"p50 {row['p50'] * 1000:.1f} мс, p95 {row['p95'] * 1000:.1f} мс, p99 {row['p99'] * 1000:.1f} мс")
+        if row['bytes']:
+            line += f", {row['bytes'] / 1024:.2f} KB, {row['bytes_per_sec'] / 1024:.2f} KB/с"
+        console_logger.info(line)
+
+def run_record(config, lpl_path, totals, report, elapsed_time):
+    # Итоги обработки плейлиста в машиночитаемом виде: для --stats_json и вызова run() из других скриптов
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'device': config.get('name', ''),
+        'host': target_name(config),
+        'playlist': lpl_path,
+        'backend': config.get('backend', 'ftp'),
+        'engine': config.get('engine', 'sync'),
+        'workers': config.get('workers', 1),
+        'dry_run': config['dry_run'],
+        'elapsed': elapsed_time,
+        'totals': totals,
+        'commands': report
+    }
+
+def write_stats_json(path, record):
+    # Дописываем итоги запуска строкой JSON, чтобы следить за скоростью между запусками
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        error_logger.error(f"Ошибка записи статистики {path}: {e}")
+
+class LocalMirror:
+    # SD-карта, смонтированная локально, за теми же методами ftplib.FTP, что вызывают функции ftp_*.
+    # Пути сервера (/roms/..., /retroarch/...) отображаются в каталог root, перемещение -
+    # os.replace (меняются только метаданные), листинг - os.scandir. Ошибки файловой системы
+    # переводятся в error_perm, чтобы не считаться обрывом соединения
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.host = 'local'
+        self.port = self.root
+
+    def local_path(self, path):
+        # normpath от корня не дает выйти за пределы root через ".."
+        return os.path.join(self.root, os.path.normpath(f"/{path}").lstrip('/\\'))
+
+    @contextmanager
+    def _errors(self):
+        try:
+            yield
+        except OSError as e:
+            raise error_perm(f"550 {e}") from e
+
+    def size(self, path):
+        with self._errors():
+            return os.path.getsize(self.local_path(path))
+
+    def mlsd(self, path='', facts=()):
+        entries = []
+        with self._errors(), os.scandir(self.local_path(path)) as it:
+            for entry in it:
+                if entry.is_dir():
+                    entries.append((entry.name, {'type': 'dir'}))
+                else:
+                    entries.append((entry.name, {'type': 'file', 'size': str(entry.stat().st_size)}))
+        return entries
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        with self._errors(), open(self.local_path(cmd.split(' ', 1)[1]), 'rb') as f:
+            while True:
+                data = f.read(blocksize)
+                if not data:
+                    break
+                callback(data)
+
+    def storbinary(self, cmd, fp, blocksize=8192, callback=None, rest=None):
+        with self._errors(), open(self.local_path(cmd.split(' ', 1)[1]), 'wb') as f:
+            while True:
+                buf = fp.read(blocksize)
+                if not buf:
+                    break
+                f.write(buf)
+                if callback is not None:
+                    callback(buf)
+
+    def rename(self, fromname, toname):
+        with self._errors():
+            os.replace(self.local_path(fromname), self.local_path(toname))
+
+    def delete(self, path):
+        with self._errors():
+            os.remove(self.local_path(path))
+
+    def mkd(self, path):
+        with self._errors():
+            os.mkdir(self.local_path(path))
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+def ftp_connect(config=None, stats=None):
+    if config is None:
+        config = get_config()
+    if config.get('backend', 'ftp') == 'local':
+        return LocalMirror(config['local_root'])
+    ftp = InstrumentedFTP(stats) if stats is not None else FTP()
     ftp.connect(config["ftp_host"], config["ftp_port"])
     ftp.login(config["ftp_user"], config["ftp_pass"])
     console_logger.info(f"Подключено к FTP: {config['ftp_host']}:{config['ftp_port']} (пользователь: {config['ftp_user']})")
     return ftp
 
+class FTPConnectionPool:
+    # Пул авторизованных FTP-соединений. Соединение, на котором произошел сетевой сбой,
+    # закрывается, а операция повторяется один раз на новом соединении
+    def __init__(self, config, size, stats=None):
+        self.config = config
+        self.size = max(1, size)
+        self.stats = stats
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return ftp_connect(self.config, self.stats)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, ftp, broken=False):
+        if broken:
+            try:
+                ftp.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._created -= 1
+        else:
+            self._idle.put(ftp)
+
+    @contextmanager
+    def connection(self):
+        ftp = self.acquire()
+        broken = False
+        try:
+            yield ftp
+        except Exception as e:
+            broken = is_connection_error(e)
+            raise
+        finally:
+            self.release(ftp, broken)
+
+    def call(self, func, *args, **kwargs):
+        # Выполняем func(ftp, ...) на свободном соединении с переподключением при обрыве
+        for attempt in range(2):
+            try:
+                with self.connection() as ftp:
+                    return func(ftp, *args, **kwargs)
+            except Exception as e:
+                if attempt or not is_connection_error(e):
+                    raise
+                error_logger.error(f"Обрыв FTP-соединения, переподключение: {e}")
+
+    def close(self):
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+def is_connection_error(e):
+    # Сетевые ошибки и ответ 421 означают, что соединение больше нельзя использовать
+    if isinstance(e, error_temp):
+        return str(e).startswith('421')
+    return isinstance(e, (OSError, EOFError))
+
+def log_skipped_error(message, e):
+    # Обрыв соединения пробрасываем: pool.call переподключится и повторит операцию целиком.
+    # Остальные ошибки только записываем в лог
+    if is_connection_error(e):
+        raise e
+    error_logger.error(f"{message}: {e}")
+
+# Общая часть движков: разбор ответов сервера, кэши и учет результатов без ввода-вывода.
+# Синхронный (ftp_*) и асинхронный (aftp_*) движки только выполняют команды FTP
+
 def ftp_get_size(ftp, path):
     try:
-        size = ftp.size(path)
-        return size if size is not None else 0
+        return ftp.size(path) or 0
     except Exception as e:
-        error_logger.error(f"Ошибка при получении размера {path}: {e}")
+        log_skipped_error(f"Ошибка при получении размера {path}", e)
         return 0
 
-def ftp_download_json(ftp, path):
-    buffer = BytesIO()
-    ftp.retrbinary(f'RETR {path}', buffer.write)
-    buffer.seek(0)
-    return json.load(buffer)
+def ftp_download_spooled(ftp, path, block_size=BLOCK_SIZE, spool_threshold=SPOOL_THRESHOLD):
+    # Скачиваем файл во временный буфер: в памяти до spool_threshold байт, дальше - на диске.
+    # Потребление памяти не зависит от размера файла
+    temp = SpooledTemporaryFile(max_size=spool_threshold)
+    try:
+        ftp.retrbinary(f'RETR {path}', temp.write, blocksize=block_size)
+    except Exception:
+        temp.close()
+        raise
+    temp.seek(0)
+    return temp
+
+def ftp_backup_and_load(ftp, path, block_size=BLOCK_SIZE, spool_threshold=SPOOL_THRESHOLD):
+    # Плейлист скачивается один раз: из тех же байтов загружается бэкап {path}.bkp
+    # и разбирается JSON
+    with ftp_download_spooled(ftp, path, block_size, spool_threshold) as temp:
+        ftp.storbinary(f'STOR {path}.bkp', temp, blocksize=block_size)
+        temp.seek(0)
+        return json.load(temp)
+
+def ftp_upload_atomic(ftp, path, data, block_size=BLOCK_SIZE):
+    # Загружаем файл под временным именем и переименовываем поверх исходного,
+    # чтобы при обрыве на сервере не остался недописанный файл
+    temp_path = f"{path}.tmp"
+    ftp.storbinary(f'STOR {temp_path}', BytesIO(data), blocksize=block_size)
+    try:
+        ftp.rename(temp_path, path)
+    except error_perm:
+        # Некоторые серверы не переименовывают поверх существующего файла
+        ftp_delete_safe(ftp, path)
+        try:
+            ftp.rename(temp_path, path)
+        except error_perm:
+            # Сервер вообще не поддерживает переименование: пишем файл напрямую
+            ftp.storbinary(f'STOR {path}', BytesIO(data), blocksize=block_size)
+            ftp_delete_safe(ftp, temp_path)
 
-def ftp_backup(ftp, path):
-    buffer = BytesIO()
-    ftp.retrbinary(f'RETR {path}', buffer.write)
-    buffer.seek(0)
-    ftp.storbinary(f'STOR {path}.bkp', buffer)
+# Серверы, отвечающие 500/502/504 на RNFR/RNTO: (host, port). Для них переименование
+# больше не пробуем и сразу перемещаем файл через RETR/STOR
+_rename_unsupported = set()
 
-def ftp_move_file(ftp, src, dest):
-    config = get_config()
-    size = ftp_get_size(ftp, src)
-    if config['dry_run']:
+def is_unsupported_error(e):
+    return str(e)[:3] in ('500', '502', '504')
+
+def rename_refused(server, src, e):
+    # Разбираем отказ в RNFR/RNTO. Сервер без переименования запоминаем и возвращаем False.
+    # Иначе (обычно 550) источника может не быть, потому что перемещение уже выполнено
+    # до обрыва: возвращаем True, и движок проверяет это через ftp_move_completed
+    logging.info(f"Сервер отклонил RNFR/RNTO для {src}: {e}")
+    if is_unsupported_error(e):
+        _rename_unsupported.add(server)
+        return False
+    return True
+
+def moved(src, dest, size, method, repeated=False):
+    # Записываем перемещение в лог и возвращаем (размер, способ)
+    if method == 'dry-run':
         logging.info(f"[DRY-RUN] Перемещение: {src} -> {dest}")
-        return size
-    temp = BytesIO()
-    ftp.retrbinary(f'RETR {src}', temp.write)
-    temp.seek(0)
-    ftp_delete_safe(ftp, src)
-    ftp_mkdirs(ftp, os.path.dirname(dest))
-    ftp.storbinary(f'STOR {dest}', temp)
-    return size
+    elif repeated:
+        logging.info(f"Перемещение уже выполнено ({MOVE_METHOD_NAMES[method]}): {src} -> {dest}")
+    else:
+        logging.info(f"Перемещение ({MOVE_METHOD_NAMES[method]}): {src} -> {dest}")
+    return size, method
+
+def ftp_move_completed(ftp, src, dest):
+    # При повторе после обрыва сервер мог уже выполнить RNTO (или STOR и DELE), а ответ потеряться.
+    # Если источника нет, а приемник есть - перемещение выполнено: возвращаем размер приемника, иначе None
+    try:
+        ftp.size(src)
+        return None
+    except error_perm:
+        pass
+    try:
+        return ftp.size(dest) or 0
+    except error_perm:
+        return None
+
+def ftp_move_file(ftp, src, dest, dry_run=None, block_size=BLOCK_SIZE, spool_threshold=SPOOL_THRESHOLD,
+                  size=None, known_dirs=None):
+    # Перемещаем файл внутри сервера командами RNFR/RNTO. Скачивание и повторная загрузка
+    # используются, только если сервер отклонил переименование.
+    # size - размер из листинга каталога (без него выполняется SIZE),
+    # known_dirs - каталоги, уже созданные за этот запуск.
+    # Возвращаем (размер, способ): 'rename', 'copy' или 'dry-run'
+    if dry_run is None:
+        dry_run = get_config()['dry_run']
+    if size is None:
+        size = ftp_get_size(ftp, src)
+    if dry_run:
+        return moved(src, dest, size, 'dry-run')
+    ftp_mkdirs(ftp, os.path.dirname(dest), known_dirs)
+    server = (ftp.host, ftp.port)
+    checked = False
+    if server not in _rename_unsupported:
+        try:
+            ftp.rename(src, dest)
+            return moved(src, dest, size, 'rename')
+        except error_perm as e:
+            if rename_refused(server, src, e):
+                done_size = ftp_move_completed(ftp, src, dest)
+                if done_size is not None:
+                    return moved(src, dest, done_size, 'rename', repeated=True)
+                checked = True
+    try:
+        temp = ftp_download_spooled(ftp, src, block_size, spool_threshold)
+    except error_perm:
+        # После отказа RNFR/RNTO состояние файлов уже проверено
+        done_size = None if checked else ftp_move_completed(ftp, src, dest)
+        if done_size is None:
+            raise
+        return moved(src, dest, done_size, 'copy', repeated=True)
+    with temp:
+        ftp.storbinary(f'STOR {dest}', temp, blocksize=block_size)
+    # Исходный файл удаляем только после успешной загрузки копии. Ошибку не глотаем:
+    # иначе запись уйдет из плейлиста, а ROM останется на месте. При обрыве pool.call
+    # повторит перемещение, и ftp_move_completed определит, дошла ли команда DELE
+    ftp.delete(src)
+    return moved(src, dest, size, 'copy')
 
 def ftp_delete_safe(ftp, path):
     try:
         ftp.delete(path)
-    except Exception:
-        pass
+    except Exception as e:
+        if is_connection_error(e):
+            raise
+
+def is_exists_error(e):
+    # Ответ на MKD для уже существующего каталога ("550 File exists", "521 Directory already exists")
+    return str(e)[:3] == '521' or 'exist' in str(e).lower()
 
-def ftp_mkdirs(ftp, path):
-    parts = path.strip('/').split('/')
+def mkd_failed(e):
+    # Итог неудачного MKD: True, если каталог уже существует. Обрыв соединения пробрасывается наверх
+    if isinstance(e, error_perm):
+        return is_exists_error(e)
+    if is_connection_error(e):
+        raise e
+    return False
+
+def parent_dirs(path):
+    # '/a/b/c' -> '/a', '/a/b', '/a/b/c'
     current = ''
-    for part in parts:
+    for part in path.strip('/').split('/'):
         current += f'/{part}'
+        yield current
+
+def ftp_mkd(ftp, path):
+    # True, если каталог создан или уже существует
+    try:
+        ftp.mkd(path)
+        return True
+    except Exception as e:
+        return mkd_failed(e)
+
+class KeyedLocks:
+    # Блокировка на каждый ключ: данные для ключа получает один поток (или задача),
+    # остальные ждут его результата. lock_factory - threading.Lock для потоков или asyncio.Lock для задач
+    def __init__(self, lock_factory=threading.Lock):
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._lock_factory = lock_factory
+
+    def lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, self._lock_factory())
+
+class KnownDirs(KeyedLocks):
+    # Каталоги, созданные (или уже существовавшие) за этот запуск. MKD для каждого пути
+    # отправляется один раз, остальные ждут его результата на блокировке пути
+    def __init__(self, lock_factory=threading.Lock):
+        super().__init__(lock_factory)
+        self._dirs = set()
+
+    def __contains__(self, path):
+        return path in self._dirs
+
+    def add(self, path):
+        self._dirs.add(path)
+
+def ftp_mkdirs(ftp, path, known_dirs=None):
+    # MKD отправляется только для каталогов, которые еще не создавались за этот запуск.
+    # Путь запоминается только после успешного MKD или ответа "уже существует"
+    for current in parent_dirs(path):
+        if known_dirs is None:
+            ftp_mkd(ftp, current)
+            continue
+        if current in known_dirs:
+            continue
+        with known_dirs.lock(current):
+            if current not in known_dirs and ftp_mkd(ftp, current):
+                known_dirs.add(current)
+
+# Форматы строк LIST: Unix (ls -l, группа может отсутствовать) и DOS/IIS
+UNIX_LIST_RE = re.compile(
+    r'^(?P<type>[-dlbcps])\S{9,10}\s+\d+\s+(?:\S+\s+){1,2}(?P<size>\d+)\s+'
+    r'[A-Za-z]{3}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4})\s(?P<name>.+)$'
+)
+DOS_LIST_RE = re.compile(
+    r'^\d{2}-\d{2}-\d{2,4}\s+\d{1,2}:\d{2}(?:[AaPp][Mm])?\s+(?:(?P<dir><DIR>)|(?P<size>\d+))\s+(?P<name>.+)$'
+)
+
+# Серверы, не поддерживающие MLSD: (host, port)
+_mlsd_unsupported = set()
+
+def parse_list_line(line):
+    # Разбираем строку LIST в (имя, каталог?, размер) или None
+    match = UNIX_LIST_RE.match(line)
+    if match:
+        name = match.group('name')
+        if match.group('type') == 'l' and ' -> ' in name:
+            name = name.split(' -> ', 1)[0]
+        return name, match.group('type') == 'd', int(match.group('size'))
+    match = DOS_LIST_RE.match(line)
+    if match:
+        is_dir = match.group('dir') is not None
+        return match.group('name'), is_dir, 0 if is_dir else int(match.group('size'))
+    # Нестандартный формат: имя - все после восьмого поля
+    parts = line.split()
+    if len(parts) < 9:
+        return None
+    size = int(parts[4]) if parts[4].isdigit() else None
+    return ' '.join(parts[8:]), line.startswith('d'), size
+
+def list_entries(lines):
+    # Строки LIST -> [(имя, каталог?, размер)]
+    entries = []
+    for line in lines:
+        entry = parse_list_line(line)
+        if entry is not None and entry[0] not in ('.', '..'):
+            entries.append(entry)
+    return entries
+
+def mlsd_entries(facts_list):
+    # Пары (имя, факты) MLSD -> [(имя, каталог?, размер)]
+    entries = []
+    for name, facts in facts_list:
+        entry_type = facts.get('type', '').lower()
+        if entry_type in ('cdir', 'pdir') or name in ('.', '..'):
+            continue
+        size = facts.get('size')
+        entries.append((name, entry_type == 'dir', int(size) if size and size.isdigit() else None))
+    return entries
+
+def mlsd_refused(server, e):
+    # True, если сервер не поддерживает MLSD: запоминаем его, дальше используется только LIST
+    if str(e)[:3] not in ('500', '501', '502', '504'):
+        return False
+    _mlsd_unsupported.add(server)
+    return True
+
+def ftp_list_dir(ftp, path):
+    # Листинг каталога: [(имя, каталог?, размер)]. MLSD, если сервер его поддерживает, иначе LIST
+    server = (ftp.host, ftp.port)
+    if server not in _mlsd_unsupported:
         try:
-            ftp.mkd(current)
-        except Exception:
-            pass
+            return mlsd_entries(ftp.mlsd(path))
+        except error_perm as e:
+            if not mlsd_refused(server, e):
+                raise
+    lines = []
+    ftp.retrlines(f'LIST {path}', lines.append)
+    return list_entries(lines)
+
+class TreeWalk:
+    # Рекурсивный обход дерева: движок перебирает каталоги и передает листинг каждого в add.
+    # Результат - files: [(путь к файлу, размер)]
+    def __init__(self, root):
+        self.files = []
+        self._stack = [root]
+
+    def __iter__(self):
+        while self._stack:
+            yield self._stack.pop()
+
+    def add(self, current, entries):
+        for name, is_dir, size in entries:
+            full_path = f"{current}/{name}" if current != '/' else f"/{name}"
+            if is_dir:
+                self._stack.append(full_path)
+            else:
+                self.files.append((full_path, size))
 
 def ftp_walk(ftp, dir_path):
-    file_paths = []
-    stack = [dir_path]
-    while stack:
-        current = stack.pop()
+    # Рекурсивный обход: [(путь к файлу, размер)]
+    walk = TreeWalk(dir_path)
+    for current in walk:
         try:
-            lines = []
-            ftp.retrlines(f'LIST {current}', lines.append)
-            for line in lines:
-                parts = line.split()
-                if not parts:
-                    continue
-                if len(parts) < 8:
-                    continue
-                name = ' '.join(parts[8:])
-                full_path = f"{current}/{name}" if current != '/' else f"/{name}"
-                if line.startswith('d'):
-                    stack.append(full_path)
-                else:
-                    file_paths.append(full_path)
+            walk.add(current, ftp_list_dir(ftp, current))
         except Exception as e:
-            error_logger.error(f"Ошибка при обходе {current}: {e}")
+            # Обрыв соединения прерывает весь обход: неполный листинг не должен попасть в кэш
+            log_skipped_error(f"Ошибка при обходе {current}", e)
+    return walk.files
+
+class DirectoryCache(KeyedLocks):
+    # Листинги каталогов ROM: каждый каталог читается один раз за запуск,
+    # размеры файлов берутся из листинга вместо отдельной команды SIZE
+    def __init__(self, lock_factory=threading.Lock):
+        super().__init__(lock_factory)
+        self._listings = {}
+
+    @staticmethod
+    def split(path):
+        dir_path, name = path.rsplit('/', 1)
+        return dir_path or '/', name
+
+    def get(self, dir_path):
+        return self._listings.get(dir_path)
+
+    def put(self, dir_path, entries):
+        listing = {name: size for name, is_dir, size in entries if not is_dir}
+        self._listings[dir_path] = listing
+        return listing
+
+def ftp_cached_size(ftp, dirs, path):
+    # Размер файла из листинга его каталога или None, если его там нет
+    dir_path, name = dirs.split(path)
+    with dirs.lock(dir_path):
+        listing = dirs.get(dir_path)
+        if listing is None:
+            try:
+                entries = ftp_list_dir(ftp, dir_path)
+            except Exception as e:
+                log_skipped_error(f"Ошибка при чтении каталога {dir_path}", e)
+                entries = []
+            listing = dirs.put(dir_path, entries)
+    return listing.get(name)
+
+def thumbnails_dir(db_name):
+    return f"/retroarch/thumbnails/{db_name}"
+
+class ThumbnailCache(KeyedLocks):
+    # Дерево миниатюр системы читается один раз за запуск и индексируется по имени файла:
+    # {db_name: {имя файла: [(полный путь, размер)]}}
+    def __init__(self, lock_factory=threading.Lock):
+        super().__init__(lock_factory)
+        self._indexes = {}
+
+    def loaded(self, db_name):
+        return db_name in self._indexes
+
+    def put(self, db_name, files):
+        index = {}
+        for path, size in files:
+            index.setdefault(path.rsplit('/', 1)[-1], []).append((path, size))
+        with self._lock:
+            self._indexes[db_name] = index
+
+    def find(self, db_name, alias):
+        # Миниатюры {alias}.png во всех подкаталогах системы
+        name = f"{alias}.png"
+        with self._lock:
+            paths = self._indexes.get(db_name, {}).get(name.rsplit('/', 1)[-1], [])
+            return [(path, size) for path, size in paths if path.endswith(f"/{name}")]
+
+    def forget(self, db_name, path):
+        # Убираем перемещенный файл из индекса, чтобы не искать его повторно
+        with self._lock:
+            paths = self._indexes.get(db_name, {}).get(path.rsplit('/', 1)[-1])
+            if paths:
+                paths[:] = [entry for entry in paths if entry[0] != path]
+
+def ftp_find_thumbnails(ftp, thumbs, db_name, alias):
+    # При обрыве ftp_walk выбрасывает исключение и индекс не сохраняется:
+    # pool.call переподключится и прочитает дерево заново
+    with thumbs.lock(db_name):
+        if not thumbs.loaded(db_name):
+            thumbs.put(db_name, ftp_walk(ftp, thumbnails_dir(db_name)))
+    return thumbs.find(db_name, alias)
+
+class ServerState:
+    # Данные о сервере, накопленные за запуск: листинги миниатюр и каталогов ROM,
+    # каталоги, уже созданные командой MKD. Асинхронный движок передает asyncio.Lock
+    def __init__(self, lock_factory=threading.Lock):
+        self.thumbs = ThumbnailCache(lock_factory)
+        self.dirs = DirectoryCache(lock_factory)
+        self.known_dirs = KnownDirs(lock_factory)
+
+class MoveJournal:
+    # Локальный журнал выполненных перемещений (JSON lines, только дозапись).
+    # После обрыва следующий запуск пропускает уже перемещенные файлы и завершенные записи.
+    # В режиме dry-run журнал только читается
+    def __init__(self, path, scope, read_only=False):
+        self.path = path
+        self.scope = scope
+        self.read_only = read_only
+        self.moved_files = {}
+        self.completed_items = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Недописанная строка после аварийного завершения
+                    if record.get('scope') != scope:
+                        continue
+                    if record.get('event') == 'file':
+                        self.moved_files[record['src']] = (record['size'], record['method'])
+                    elif record.get('event') == 'item':
+                        self.completed_items[record['path']] = record
+
+    def _append(self, record):
+        if self.read_only:
+            return
+        record['scope'] = self.scope
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+
+    def moved(self, src):
+        # (размер, 'journal'), если файл перемещен в прошлом запуске, иначе None
+        if src not in self.moved_files:
+            return None
+        size, _ = self.moved_files[src]
+        return size, 'journal'
+
+    def record_file(self, src, dest, size, method):
+        if method != 'dry-run':
+            self._append({'event': 'file', 'src': src, 'dest': dest, 'size': size, 'method': method})
+
+    def record_item(self, path, result):
+        self._append({'event': 'item', 'path': path, 'rom_size': result['rom_size'],
+                      'thumbs_size': result['thumbs_size'], 'thumb_count': result['thumb_count']})
+
+    def close(self, completed=False):
+        # После успешной записи плейлиста записи этого scope больше не нужны.
+        # Записи других scope (другой сервер, SD-карта, плейлист) остаются в файле:
+        # их прерванные запуски еще будут продолжены
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if completed and not self.read_only and os.path.exists(self.path):
+            self._drop_scope()
+
+    def _drop_scope(self):
+        kept = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('scope') != self.scope:
+                    kept.append(line if line.endswith('\n') else line + '\n')
+        if not kept:
+            os.remove(self.path)
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.writelines(kept)
+        os.replace(temp_path, self.path)
+
+def move_with_journal(pool, journal, src, dest, dry_run, size, transfer):
+    # Файл, перемещенный в прошлом запуске, повторно не переносится
+    done = journal.moved(src)
+    if done is not None:
+        return done
+    size, method = pool.call(ftp_move_file, src, dest, dry_run, size=size, **transfer)
+    journal.record_file(src, dest, size, method)
+    return size, method
+
+def parse_item(item, base_content_directory):
+    # Запись плейлиста -> (путь записи, путь ROM, db_name, alias)
+    path = item.get('path', '')
+    entry = parse_entry(item, base_content_directory)
+    if entry is None or '#' not in path:
+        raise ValueError(f"Некорректный путь: {path}")
+    return path, entry.rom_path, entry.db_name, entry.alias
+
+def deleted_path(path):
+    # Файлы переносятся в /del с сохранением исходного пути
+    return f"/del{path}"
+
+def transfer_options(config, state):
+    return {
+        'block_size': config.get('block_size', BLOCK_SIZE),
+        'spool_threshold': config.get('spool_threshold', SPOOL_THRESHOLD),
+        'known_dirs': state.known_dirs
+    }
+
+def item_result(rom_size, rom_method):
+    result = {
+        'rom_size': rom_size,
+        'thumbs_size': 0,
+        'thumb_count': 0,
+        'methods': {'rename': 0, 'copy': 0, 'dry-run': 0, 'journal': 0}
+    }
+    result['methods'][rom_method] += 1
+    return result
+
+def add_thumbnail(result, state, db_name, thumb, size, method, dry_run):
+    result['methods'][method] += 1
+    result['thumbs_size'] += size
+    result['thumb_count'] += 1
+    if not dry_run:
+        state.thumbs.forget(db_name, thumb)
+
+def finish_item(item, path, src_rom, rom_method, result, dry_run, journal):
+    console_logger.info(f"[OK] {os.path.basename(src_rom)}, миниатюр: {result['thumb_count']}, способ: {MOVE_METHOD_NAMES[rom_method]}")
+    processed_logger.info(json.dumps(item, ensure_ascii=False))
+    if not dry_run:
+        journal.record_item(path, result)
+    return result
+
+def item_failed(item, e):
+    # Ошибки записи не прерывают обработку остальных записей
+    path = item.get('path', '')
+    console_logger.info(f"[ERROR] {os.path.basename(path)}, {str(e)}")
+    error_logger.error(f"Ошибка в {path}: {e}")
+    return None, e
+
+def process_item(pool, item, base_content_directory, state, dry_run, journal):
+    # Перемещаем ROM и его миниатюры для одной записи плейлиста
+    path, src_rom, db_name, alias = parse_item(item, base_content_directory)
+    transfer = transfer_options(pool.config, state)
+
+    known_size = None if src_rom in journal.moved_files else pool.call(ftp_cached_size, state.dirs, src_rom)
+    rom_size, rom_method = move_with_journal(pool, journal, src_rom, deleted_path(src_rom), dry_run, known_size, transfer)
+    result = item_result(rom_size, rom_method)
+
+    for thumb, known_size in pool.call(ftp_find_thumbnails, state.thumbs, db_name, alias):
+        thumb_size, thumb_method = move_with_journal(pool, journal, thumb, deleted_path(thumb), dry_run, known_size, transfer)
+        add_thumbnail(result, state, db_name, thumb, thumb_size, thumb_method, dry_run)
+
+    return finish_item(item, path, src_rom, rom_method, result, dry_run, journal)
+
+def process_item_safe(pool, item, base_content_directory, state, dry_run, journal):
+    try:
+        return process_item(pool, item, base_content_directory, state, dry_run, journal), None
+    except Exception as e:
+        return item_failed(item, e)
+
+def split_restored_items(items, journal):
+    # Записи, завершенные в прерванном запуске, берем из журнала без повторной обработки:
+    # {путь записи: запись журнала}
+    restored = {item.get('path', ''): journal.completed_items[item.get('path', '')]
+                for item in items if item.get('path', '') in journal.completed_items}
+    pending = [item for item in items if item.get('path', '') not in restored]
+    if restored:
+        console_logger.info(f"Восстановлено из журнала: {len(restored)} записей")
+    return restored, pending
+
+def collect_results(data, items, pending, results, restored):
+    # Суммируем результаты в исходном порядке записей и убираем обработанные записи из плейлиста
+    totals = {
+        'moved_roms': 0,
+        'moved_thumbs': 0,
+        'move_methods': {'rename': 0, 'copy': 0, 'dry-run': 0, 'journal': 0},
+        'total_roms_size': 0,
+        'total_thumbs_size': 0,
+        'error_count': 0,
+        'processed_count': 0
+    }
+    done_paths = set(restored)
+    # Записи из журнала учитываем с размерами, сохраненными при их обработке
+    for record in restored.values():
+        totals['moved_roms'] += 1
+        totals['total_roms_size'] += record.get('rom_size', 0)
+        totals['moved_thumbs'] += record.get('thumb_count', 0)
+        totals['total_thumbs_size'] += record.get('thumbs_size', 0)
+        totals['move_methods']['journal'] += 1 + record.get('thumb_count', 0)
+    for item, (result, error) in zip(pending, results):
+        if error is not None:
+            totals['error_count'] += 1
             continue
-    return file_paths
+        totals['moved_roms'] += 1
+        totals['total_roms_size'] += result['rom_size']
+        totals['moved_thumbs'] += result['thumb_count']
+        totals['total_thumbs_size'] += result['thumbs_size']
+        for method, count in result['methods'].items():
+            totals['move_methods'][method] += count
+        done_paths.add(item.get('path', ''))
 
-def main():
-    start_time = time.time()
+    # Удаляем обработанные записи за один проход
+    remaining = [item for item in items if item.get('path', '') not in done_paths]
+    totals['processed_count'] = len(items) - len(remaining)
+    data['items'] = remaining
+    return totals
+
+def print_summary(totals, start_time, config, stats, lpl_path):
+    total_size_mb = (totals['total_roms_size'] + totals['total_thumbs_size']) / (1024 * 1024)
+    elapsed_time = time.time() - start_time
+    report = stats.report()
+
+    console_logger.info(f"\n{Colors.BLUE}=== Итоги ===")
+    console_logger.info(f"ROM-файлов: {totals['moved_roms']} ({totals['total_roms_size'] / 1024:.2f} KB)")
+    console_logger.info(f"Миниатюр: {totals['moved_thumbs']} ({totals['total_thumbs_size'] / 1024:.2f} KB)")
+    console_logger.info(f"Общий размер: {total_size_mb:.2f} MB")
+    console_logger.info(f"Перемещено на сервере (RNFR/RNTO): {totals['move_methods']['rename']}, "
+                        f"копированием (RETR/STOR): {totals['move_methods']['copy']}")
+    console_logger.info(f"Удалено из плейлиста записей: {totals['processed_count']}")
+    console_logger.info(f"Время работы: {elapsed_time:.2f} сек")
+    print_command_stats(report)
+    console_logger.info(f"Ошибок: {totals['error_count']}{Colors.RESET}")
+    record = run_record(config, lpl_path, totals, report, elapsed_time)
+    if config.get('stats_json'):
+        write_stats_json(config['stats_json'], record)
+    return record
+
+def journal_path(config, lpl_path):
+    # У каждого плейлиста свой журнал: журнал удаляется после успешной записи плейлиста
+    # и не должен уносить с собой незавершенные перемещения другого плейлиста
+    journal_file = config.get('journal_file', JOURNAL_FILE)
+    name = os.path.splitext(os.path.basename(lpl_path))[0]
+    if lpl_path == DELETE_PLAYLIST or not name:
+        return journal_file
+    base, ext = os.path.splitext(journal_file)
+    return f"{base}_{name}{ext}"
+
+def start_playlist(pool, lpl_path):
+    # Начало обработки плейлиста: статистика команд считается отдельно для каждого плейлиста
+    pool.stats.reset()
+    console_logger.info(f"Плейлист: {lpl_path}")
+    console_logger.info("Создание бэкапа...")
+    return time.time()
+
+def open_playlist(config, lpl_path, data):
+    # Плейлист загружен: открываем журнал и отделяем записи, завершенные в прерванном запуске.
+    # Возвращаем (base_content_directory, items, journal, restored, pending)
+    base_content_directory = data.get('base_content_directory', '')
+    items = data.get('items', [])
+
+    console_logger.info(f"Каталог ROM: {base_content_directory}")
+    console_logger.info(f"Найдено записей: {len(items)}")
+
+    journal = MoveJournal(journal_path(config, lpl_path), f"{target_name(config)}{lpl_path}", read_only=config['dry_run'])
+    restored, pending = split_restored_items(items, journal)
+    return base_content_directory, items, journal, restored, pending
+
+def playlist_bytes(data):
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+def process_playlist(pool, config, lpl_path, state):
+    start_time = start_playlist(pool, lpl_path)
+    dry_run = config['dry_run']
+    block_size = config.get('block_size', BLOCK_SIZE)
+    spool_threshold = config.get('spool_threshold', SPOOL_THRESHOLD)
+    data = pool.call(ftp_backup_and_load, lpl_path, block_size, spool_threshold)
+    base_content_directory, items, journal, restored, pending = open_playlist(config, lpl_path, data)
+
+    # Записи обрабатываются параллельно, итоги собираются в исходном порядке записей
+    if pool.size > 1 and len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = [executor.submit(process_item_safe, pool, item, base_content_directory, state, dry_run, journal)
+                       for item in pending]
+            results = [future.result() for future in futures]
+    else:
+        results = [process_item_safe(pool, item, base_content_directory, state, dry_run, journal) for item in pending]
+
+    totals = collect_results(data, items, pending, results, restored)
+
+    if not dry_run:
+        pool.call(ftp_upload_atomic, lpl_path, playlist_bytes(data), block_size)
+    journal.close(completed=not dry_run)
+
+    return print_summary(totals, start_time, config, pool.stats, lpl_path)
+
+def print_dry_run_banner(config):
+    if config['dry_run']:
+        console_logger.info(f"\n{Colors.YELLOW}=== DRY-RUN MODE: Файлы не будут перемещены ==={Colors.RESET}\n")
+
+def playlist_failed(lpl_path, e):
+    error_logger.error(f"Критическая ошибка ({lpl_path}): {e}")
+    console_logger.info(f"{Colors.RED}[ERROR] {lpl_path}: {str(e)}{Colors.RESET}")
+
+def run(config):
+    # Обрабатываем плейлисты устройства по очереди на общем наборе соединений.
+    # Возвращаем итоги по каждому успешно обработанному плейлисту
+    local = config.get('backend', 'ftp') == 'local'
+    if local and not os.path.isdir(config.get('local_root') or ''):
+        console_logger.info(f"{Colors.RED}[ERROR] Каталог SD-карты не найден: {config.get('local_root')}{Colors.RESET}")
+        return []
+    if config.get('engine', 'sync') == 'async':
+        if not local:
+            return asyncio.run(run_async(config))
+        console_logger.info("Для локальной копии используется синхронный движок")
+    if local:
+        console_logger.info(f"Локальная копия SD-карты: {os.path.abspath(config['local_root'])}")
+    print_dry_run_banner(config)
+
+    pool = FTPConnectionPool(config, max(1, config.get('workers', 1)), CommandStats())
+    # Индексы миниатюр и листинги каталогов общие для всех плейлистов устройства
+    state = ServerState()
+    records = []
     try:
-        config = get_config()
-        if config['dry_run']:
-            console_logger.info(f"\n{Colors.YELLOW}=== DRY-RUN MODE: Файлы не будут перемещены ==={Colors.RESET}\n")
+        for lpl_path in config.get('playlists') or [DELETE_PLAYLIST]:
+            try:
+                records.append(process_playlist(pool, config, lpl_path, state))
+            except Exception as e:
+                playlist_failed(lpl_path, e)
+    finally:
+        pool.close()
+    return records
+
+# === Асинхронный движок ===
+# Та же последовательность операций, что и в синхронном пути, но на asyncio. Разбор ответов,
+# кэши и учет результатов общие с синхронным движком, здесь только команды FTP через await.
+# Листинг миниатюр и перемещение ROM одной записи идут одновременно,
+# а записи обрабатываются параллельно в пределах лимита соединений к серверу
+
+class InstrumentedAsyncFTP(AsyncFTP):
+    # Асинхронный аналог InstrumentedFTP; MLSD так же учитывается через retrlines
+    def __init__(self, stats):
+        super().__init__()
+        self.stats = stats
 
-        ftp = ftp_connect()
-        dry_run = config['dry_run']
+    async def retrbinary(self, cmd, callback, blocksize=8192):
+        with self.stats.measure(command_name(cmd)) as counter:
+            def counting(data):
+                counter[0] += len(data)
+                callback(data)
+            return await super().retrbinary(cmd, counting, blocksize)
 
-        lpl_path = '/retroarch/playlists/delete.lpl'
-        backup_path = f"{lpl_path}.bkp"
+    async def storbinary(self, cmd, fp, blocksize=8192, callback=None):
+        with self.stats.measure(command_name(cmd)) as counter:
+            def counting(data):
+                counter[0] += len(data)
+                if callback is not None:
+                    callback(data)
+            return await super().storbinary(cmd, fp, blocksize, counting)
 
-        console_logger.info("Создание бэкапа...")
-        ftp_backup(ftp, lpl_path)
-        data = ftp_download_json(ftp, lpl_path)
+    async def retrlines(self, cmd):
+        with self.stats.measure(command_name(cmd)) as counter:
+            lines = await super().retrlines(cmd)
+            counter[0] = sum(len(line) + 2 for line in lines)
+            return lines
 
-        base_content_directory = data.get('base_content_directory', '')
-        items = data.get('items', [])
+    async def size(self, filename):
+        with self.stats.measure('SIZE'):
+            return await super().size(filename)
 
-        console_logger.info(f"Каталог ROM: {base_content_directory}")
-        console_logger.info(f"Найдено записей: {len(items)}")
+    async def mkd(self, dirname):
+        with self.stats.measure('MKD'):
+            return await super().mkd(dirname)
 
-        moved_roms = 0
-        moved_thumbs = 0
-        total_roms_size = 0
-        total_thumbs_size = 0
-        error_count = 0
-        processed_items = []
+    async def delete(self, filename):
+        with self.stats.measure('DELE'):
+            return await super().delete(filename)
 
-        for item in items:
-            rom_size = 0
-            thumbs_size = 0
-            thumb_count = 0
+    async def rename(self, fromname, toname):
+        with self.stats.measure('RNFR/RNTO'):
+            return await super().rename(fromname, toname)
+
+async def aftp_connect(config, stats=None):
+    ftp = InstrumentedAsyncFTP(stats) if stats is not None else AsyncFTP()
+    await ftp.connect(config["ftp_host"], config["ftp_port"])
+    await ftp.login(config["ftp_user"], config["ftp_pass"])
+    console_logger.info(f"Подключено к FTP: {config['ftp_host']}:{config['ftp_port']} (пользователь: {config['ftp_user']})")
+    return ftp
+
+class AsyncFTPConnectionPool:
+    # Асинхронный аналог FTPConnectionPool: не больше size одновременных сессий к серверу
+    def __init__(self, config, size, stats=None):
+        self.config = config
+        self.size = max(1, size)
+        self.stats = stats
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.size)
+
+    async def call(self, func, *args, **kwargs):
+        for attempt in range(2):
+            await self._slots.acquire()
+            ftp = None
+            try:
+                ftp = self._idle.pop() if self._idle else await aftp_connect(self.config, self.stats)
+                result = await func(ftp, *args, **kwargs)
+                self._idle.append(ftp)
+                return result
+            except Exception as e:
+                if ftp is not None:
+                    if is_connection_error(e):
+                        ftp.close()
+                    else:
+                        self._idle.append(ftp)
+                if attempt or not is_connection_error(e):
+                    raise
+                error_logger.error(f"Обрыв FTP-соединения, переподключение: {e}")
+            finally:
+                self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            ftp = self._idle.pop()
             try:
-                path = item.get('path', '')
-                if '#' not in path:
-                    raise ValueError(f"Некорректный путь: {path}")
+                await ftp.quit()
+            except Exception:
+                ftp.close()
+
+async def aftp_get_size(ftp, path):
+    try:
+        return await ftp.size(path) or 0
+    except Exception as e:
+        log_skipped_error(f"Ошибка при получении размера {path}", e)
+        return 0
+
+async def aftp_download_spooled(ftp, path, block_size=BLOCK_SIZE, spool_threshold=SPOOL_THRESHOLD):
+    temp = SpooledTemporaryFile(max_size=spool_threshold)
+    try:
+        await ftp.retrbinary(f'RETR {path}', temp.write, blocksize=block_size)
+    except Exception:
+        temp.close()
+        raise
+    temp.seek(0)
+    return temp
 
-                file_path, alias_ext = path.split('#')
-                alias = alias_ext.rsplit('.', 1)[0]
-                db_name = item.get('db_name', '').rsplit('.', 1)[0]
+async def aftp_backup_and_load(ftp, path, block_size=BLOCK_SIZE, spool_threshold=SPOOL_THRESHOLD):
+    with await aftp_download_spooled(ftp, path, block_size, spool_threshold) as temp:
+        await ftp.storbinary(f'STOR {path}.bkp', temp, blocksize=block_size)
+        temp.seek(0)
+        return json.load(temp)
 
-                src_rom = file_path
-                dest_rom = f"/del{src_rom}"
+async def aftp_upload_atomic(ftp, path, data, block_size=BLOCK_SIZE):
+    temp_path = f"{path}.tmp"
+    await ftp.storbinary(f'STOR {temp_path}', BytesIO(data), blocksize=block_size)
+    try:
+        await ftp.rename(temp_path, path)
+    except error_perm:
+        await aftp_delete_safe(ftp, path)
+        try:
+            await ftp.rename(temp_path, path)
+        except error_perm:
+            await ftp.storbinary(f'STOR {path}', BytesIO(data), blocksize=block_size)
+            await aftp_delete_safe(ftp, temp_path)
+
+async def aftp_delete_safe(ftp, path):
+    try:
+        await ftp.delete(path)
+    except Exception as e:
+        if is_connection_error(e):
+            raise
 
-                rom_size = ftp_move_file(ftp, src_rom, dest_rom)
-                moved_roms += 1
-                total_roms_size += rom_size
+async def aftp_mkd(ftp, path):
+    try:
+        await ftp.mkd(path)
+        return True
+    except Exception as e:
+        return mkd_failed(e)
 
-                thumbs_base = f"/retroarch/thumbnails/{db_name}"
-                all_files = ftp_walk(ftp, thumbs_base)
-                thumb_matches = [f for f in all_files if f.endswith(f"/{alias}.png")]
+async def aftp_mkdirs(ftp, path, known_dirs=None):
+    for current in parent_dirs(path):
+        if known_dirs is None:
+            await aftp_mkd(ftp, current)
+            continue
+        if current in known_dirs:
+            continue
+        async with known_dirs.lock(current):
+            if current not in known_dirs and await aftp_mkd(ftp, current):
+                known_dirs.add(current)
 
-                for thumb in thumb_matches:
-                    rel_path = thumb[len(thumbs_base):]
-                    dest_thumb = f"/del/retroarch/thumbnails/{db_name}{rel_path}"
-                    thumb_size = ftp_move_file(ftp, thumb, dest_thumb)
-                    thumbs_size += thumb_size
-                    thumb_count += 1
+async def aftp_move_completed(ftp, src, dest):
+    try:
+        await ftp.size(src)
+        return None
+    except error_perm:
+        pass
+    try:
+        return await ftp.size(dest) or 0
+    except error_perm:
+        return None
 
-                moved_thumbs += thumb_count
-                total_thumbs_size += thumbs_size
+async def aftp_move_file(ftp, src, dest, dry_run, block_size=BLOCK_SIZE, spool_threshold=SPOOL_THRESHOLD,
+                         size=None, known_dirs=None):
+    if size is None:
+        size = await aftp_get_size(ftp, src)
+    if dry_run:
+        return moved(src, dest, size, 'dry-run')
+    await aftp_mkdirs(ftp, os.path.dirname(dest), known_dirs)
+    server = (ftp.host, ftp.port)
+    checked = False
+    if server not in _rename_unsupported:
+        try:
+            await ftp.rename(src, dest)
+            return moved(src, dest, size, 'rename')
+        except error_perm as e:
+            if rename_refused(server, src, e):
+                done_size = await aftp_move_completed(ftp, src, dest)
+                if done_size is not None:
+                    return moved(src, dest, done_size, 'rename', repeated=True)
+                checked = True
+    try:
+        temp = await aftp_download_spooled(ftp, src, block_size, spool_threshold)
+    except error_perm:
+        done_size = None if checked else await aftp_move_completed(ftp, src, dest)
+        if done_size is None:
+            raise
+        return moved(src, dest, done_size, 'copy', repeated=True)
+    with temp:
+        await ftp.storbinary(f'STOR {dest}', temp, blocksize=block_size)
+    await ftp.delete(src)
+    return moved(src, dest, size, 'copy')
 
-                console_logger.info(f"[OK] {os.path.basename(src_rom)}, миниатюр: {thumb_count}")
-                processed_logger.info(json.dumps(item, ensure_ascii=False))
-                processed_items.append(item)
+async def aftp_list_dir(ftp, path):
+    server = (ftp.host, ftp.port)
+    if server not in _mlsd_unsupported:
+        try:
+            return mlsd_entries(await ftp.mlsd(path))
+        except error_perm as e:
+            if not mlsd_refused(server, e):
+                raise
+    return list_entries(await ftp.retrlines(f'LIST {path}'))
 
+async def aftp_walk(ftp, dir_path):
+    walk = TreeWalk(dir_path)
+    for current in walk:
+        try:
+            walk.add(current, await aftp_list_dir(ftp, current))
+        except Exception as e:
+            log_skipped_error(f"Ошибка при обходе {current}", e)
+    return walk.files
+
+async def aftp_cached_size(ftp, dirs, path):
+    dir_path, name = dirs.split(path)
+    async with dirs.lock(dir_path):
+        listing = dirs.get(dir_path)
+        if listing is None:
+            try:
+                entries = await aftp_list_dir(ftp, dir_path)
             except Exception as e:
-                error_count += 1
-                console_logger.info(f"[ERROR] {os.path.basename(path)}, {str(e)}")
-                error_logger.error(f"Ошибка в {path}: {e}")
+                log_skipped_error(f"Ошибка при чтении каталога {dir_path}", e)
+                entries = []
+            listing = dirs.put(dir_path, entries)
+    return listing.get(name)
+
+async def aftp_find_thumbnails(ftp, thumbs, db_name, alias):
+    async with thumbs.lock(db_name):
+        if not thumbs.loaded(db_name):
+            thumbs.put(db_name, await aftp_walk(ftp, thumbnails_dir(db_name)))
+    return thumbs.find(db_name, alias)
 
-        for item in processed_items:
-            items.remove(item)
+async def amove_with_journal(pool, journal, src, dest, dry_run, size, transfer):
+    done = journal.moved(src)
+    if done is not None:
+        return done
+    size, method = await pool.call(aftp_move_file, src, dest, dry_run, size=size, **transfer)
+    journal.record_file(src, dest, size, method)
+    return size, method
 
-        if not dry_run:
-            buffer = BytesIO()
-            buffer.write(json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
-            buffer.seek(0)
-            ftp.storbinary(f'STOR {lpl_path}', buffer)
+async def aprocess_item(pool, item, base_content_directory, state, dry_run, journal):
+    path, src_rom, db_name, alias = parse_item(item, base_content_directory)
+    transfer = transfer_options(pool.config, state)
 
-        total_size_mb = (total_roms_size + total_thumbs_size) / (1024 * 1024)
-        elapsed_time = time.time() - start_time
+    async def move_rom():
+        known_size = None if src_rom in journal.moved_files else await pool.call(aftp_cached_size, state.dirs, src_rom)
+        return await amove_with_journal(pool, journal, src_rom, deleted_path(src_rom), dry_run, known_size, transfer)
 
-        console_logger.info(f"\n{Colors.BLUE}=== Итоги ===")
-        console_logger.info(f"ROM-файлов: {moved_roms} ({total_roms_size / 1024:.2f} KB)")
-        console_logger.info(f"Миниатюр: {moved_thumbs} ({total_thumbs_size / 1024:.2f} KB)")
-        console_logger.info(f"Общий размер: {total_size_mb:.2f} MB")
-        console_logger.info(f"Время работы: {elapsed_time:.2f} сек")
-        console_logger.info(f"Ошибок: {error_count}{Colors.RESET}")
+    # Листинг миниатюр не зависит от перемещения ROM, поэтому выполняется одновременно с ним.
+    # Сами миниатюры перемещаются только после успешного перемещения ROM
+    thumbs_task = asyncio.ensure_future(pool.call(aftp_find_thumbnails, state.thumbs, db_name, alias))
+    try:
+        rom_size, rom_method = await move_rom()
+    except Exception:
+        await asyncio.gather(thumbs_task, return_exceptions=True)
+        raise
+    result = item_result(rom_size, rom_method)
+    thumb_matches = await thumbs_task
 
-        ftp.quit()
+    moves = [amove_with_journal(pool, journal, thumb, deleted_path(thumb), dry_run, known_size, transfer)
+             for thumb, known_size in thumb_matches]
+    for (thumb, _), (thumb_size, thumb_method) in zip(thumb_matches, await asyncio.gather(*moves)):
+        add_thumbnail(result, state, db_name, thumb, thumb_size, thumb_method, dry_run)
 
+    return finish_item(item, path, src_rom, rom_method, result, dry_run, journal)
+
+async def aprocess_item_safe(pool, item, base_content_directory, state, dry_run, journal):
+    try:
+        return await aprocess_item(pool, item, base_content_directory, state, dry_run, journal), None
+    except Exception as e:
+        return item_failed(item, e)
+
+async def aprocess_playlist(pool, config, lpl_path, state):
+    start_time = start_playlist(pool, lpl_path)
+    dry_run = config['dry_run']
+    block_size = config.get('block_size', BLOCK_SIZE)
+    spool_threshold = config.get('spool_threshold', SPOOL_THRESHOLD)
+    data = await pool.call(aftp_backup_and_load, lpl_path, block_size, spool_threshold)
+    base_content_directory, items, journal, restored, pending = open_playlist(config, lpl_path, data)
+
+    results = await asyncio.gather(*(aprocess_item_safe(pool, item, base_content_directory, state, dry_run, journal)
+                                     for item in pending))
+    totals = collect_results(data, items, pending, results, restored)
+
+    if not dry_run:
+        await pool.call(aftp_upload_atomic, lpl_path, playlist_bytes(data), block_size)
+    journal.close(completed=not dry_run)
+
+    return print_summary(totals, start_time, config, pool.stats, lpl_path)
+
+async def run_async(config):
+    print_dry_run_banner(config)
+
+    pool = AsyncFTPConnectionPool(config, config.get('workers', 1), CommandStats())
+    state = ServerState(asyncio.Lock)
+    records = []
+    try:
+        for lpl_path in config.get('playlists') or [DELETE_PLAYLIST]:
+            try:
+                records.append(await aprocess_playlist(pool, config, lpl_path, state))
+            except Exception as e:
+                playlist_failed(lpl_path, e)
+    finally:
+        await pool.close()
+    return records
+
+# === Пакетный режим: несколько устройств и плейлистов ===
+# Устройства перечисляются в JSON-файле:
+# {"defaults": {...общие настройки...},
+#  "devices": [{"name": "switch1", "ftp_host": "192.168.1.56", "ftp_port": 5000,
+#               "playlists": ["/retroarch/playlists/delete.lpl"]}, ...]}
+# Настройки устройства перекрывают defaults, флаги, явно заданные в командной строке, - настройки устройства.
+# Каждое устройство обрабатывается в отдельном процессе со своим набором соединений
+# и своими логами в <log_dir>/<имя устройства>/
+
+def load_devices(path, base_config, names=None, overrides=None):
+    # Приоритет настроек: base_config < defaults файла < устройство < флаги, явно переданные в командной строке
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    defaults = data.get('defaults', {})
+    devices = []
+    used_names = set()
+    for index, device in enumerate(data.get('devices', [])):
+        config = {**base_config, **defaults, **device, **(overrides or {})}
+        name = re.sub(r'[^\w.-]+', '_', str(config.get('name') or f"device{index + 1}"))
+        if name in used_names:
+            raise ValueError(f"Повторяющееся имя устройства: {name}")
+        used_names.add(name)
+        config['name'] = name
+        if names and name not in names:
+            continue
+        devices.append(config)
+    return devices
+
+def setup_device_logging(config):
+    # Перенаправляем general.log, error.log и processed.log в каталог устройства,
+    # консольные сообщения помечаем именем устройства
+    device_dir = os.path.join(config['log_dir'], config['name'])
+    setup_logging(device_dir)
+    console_handler.setFormatter(logging.Formatter(f"[{config['name']}] %(message)s"))
+    return device_dir
+
+def run_device(config):
+    # Обработка одного устройства в пакетном режиме. Относительные пути журнала
+    # и статистики отсчитываются от каталога логов устройства
+    device_dir = setup_device_logging(config)
+    for key in ('journal_file', 'stats_json'):
+        if config.get(key) and not os.path.isabs(config[key]):
+            config[key] = os.path.join(device_dir, config[key])
+    try:
+        records = run(config)
     except Exception as e:
         error_logger.error(f"Критическая ошибка: {e}")
         console_logger.info(f"{Colors.RED}[ERROR] {str(e)}{Colors.RESET}")
+        records = []
+    with open(os.path.join(device_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    return records
+
+def run_devices(devices):
+    if len(devices) > 1:
+        mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=len(devices), mp_context=mp_context) as executor:
+            futures = [executor.submit(run_device, config) for config in devices]
+            results = []
+            for config, future in zip(devices, futures):
+                try:
+                    results.append((config, future.result(), None))
+                except Exception as e:
+                    results.append((config, [], e))
+    else:
+        results = [(config, run_device(config), None) for config in devices]
+    print_devices_summary(results)
+    return results
+
+def print_devices_summary(results):
+    console_logger.info(f"\n{Colors.BLUE}=== Итоги по устройствам ===")
+    for config, records, error in results:
+        name = config['name']
+        playlists = config.get('playlists') or [DELETE_PLAYLIST]
+        if error is not None:
+            console_logger.info(f"{name}: ошибка процесса: {error}")
+            continue
+        done = {record['playlist'] for record in records}
+        for record in records:
+            totals = record['totals']
+            console_logger.info(
+                f"{name} {record['playlist']}: ROM {totals['moved_roms']}, миниатюр {totals['moved_thumbs']}, "
+                f"удалено записей {totals['processed_count']}, ошибок {totals['error_count']}, {record['elapsed']:.2f} сек")
+        for lpl_path in playlists:
+            if lpl_path not in done:
+                console_logger.info(f"{name} {lpl_path}: не обработан, см. {os.path.join(config['log_dir'], name, 'error.log')}")
+    console_logger.info(Colors.RESET)
+
+def main():
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Перемещение ROM и миниатюр из плейлиста delete.lpl по FTP")
+    # Флаги без значения по умолчанию: в config попадают только явно переданные,
+    # чтобы в пакетном режиме они перекрывали настройки из файла устройств
+    parser.add_argument("--workers", type=int, default=argparse.SUPPRESS,
+                        help=f"Количество параллельных FTP-соединений (по умолчанию {config['workers']})")
+    parser.add_argument("--engine", choices=('sync', 'async'), default=argparse.SUPPRESS,
+                        help=f"Движок обработки: синхронный (потоки) или asyncio (по умолчанию {config['engine']})")
+    parser.add_argument("--backend", choices=('ftp', 'local'), default=argparse.SUPPRESS,
+                        help=f"Работа с консолью по FTP или с локально смонтированной SD-картой (по умолчанию {config['backend']})")
+    parser.add_argument("--local_root", default=argparse.SUPPRESS,
+                        help="Каталог, в который смонтирована SD-карта (для --backend local)")
+    parser.add_argument("--stats_json", default=argparse.SUPPRESS,
+                        help="Дописать статистику запуска и FTP-команд строкой JSON в указанный файл")
+    parser.add_argument("--playlist", action="append", dest="playlists", default=argparse.SUPPRESS,
+                        help=f"Путь к плейлисту на устройстве, можно указать несколько раз (по умолчанию {DELETE_PLAYLIST})")
+    parser.add_argument("--devices", help="JSON-файл со списком устройств и плейлистов для пакетной обработки")
+    parser.add_argument("--device", action="append", help="Обработать только указанные устройства из --devices")
+    parser.add_argument("--log_dir", default=argparse.SUPPRESS,
+                        help=f"Каталог логов пакетного режима (по умолчанию {config['log_dir']})")
+    args = parser.parse_args()
+    overrides = {key: value for key, value in vars(args).items() if key not in ('devices', 'device')}
+    if 'workers' in overrides:
+        overrides['workers'] = max(1, overrides['workers'])
+    config.update(overrides)
+    if args.devices:
+        # Общие логи не создаются: каждое устройство пишет в свой каталог в log_dir
+        try:
+            devices = load_devices(args.devices, config, args.device, overrides)
+        except (OSError, ValueError) as e:
+            console_logger.info(f"{Colors.RED}[ERROR] Не удалось прочитать {args.devices}: {e}{Colors.RESET}")
+            return
+        if not devices:
+            console_logger.info("В файле устройств нет подходящих устройств")
+            return
+        run_devices(devices)
+    else:
+        setup_logging()
+        run(config)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+from datetime import datetime, timezone
+
+# Минимальный FTP-сервер в том же процессе для замеров и проверки delete_ftp_lpl_processor.py
+# без консоли. Отдает каталог root, поддерживает только пассивный режим и команды,
+# которые использует скрипт. Задержка latency добавляется к каждой команде,
+# чтобы имитировать медленную сеть до консоли
+
+class LocalFTPHandler(socketserver.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(f"{line}\r\n".encode('utf-8'))
+
+    def real_path(self, path):
+        if not path.startswith('/'):
+            path = f"{self.cwd.rstrip('/')}/{path}"
+        # normpath убирает ".." в пределах корня, выйти за root нельзя
+        return os.path.join(self.server.root, os.path.normpath(path).lstrip('/'))
+
+    def open_data(self):
+        try:
+            conn, _ = self.passive.accept()
+        finally:
+            self.passive.close()
+            self.passive = None
+        return conn
+
+    def handle(self):
+        self.cwd = '/'
+        self.passive = None
+        self.rename_from = None
+        self.send('220 Local FTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            cmd, _, arg = line.decode('utf-8').rstrip('\r\n').partition(' ')
+            cmd = cmd.upper()
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            self.server.record(cmd)
+            try:
+                if not self.dispatch(cmd, arg):
+                    break
+            except OSError as e:
+                self.send(f'550 {e}')
+        if self.passive is not None:
+            self.passive.close()
+
+    def dispatch(self, cmd, arg):
+        if cmd == 'USER':
+            self.send('331 Password required')
+        elif cmd == 'PASS':
+            self.send('230 Logged in')
+        elif cmd == 'TYPE':
+            self.send('200 Type set')
+        elif cmd == 'PWD':
+            self.send(f'257 "{self.cwd}"')
+        elif cmd == 'CWD':
+            if not os.path.isdir(self.real_path(arg)):
+                self.send('550 No such directory')
+            else:
+                self.cwd = arg
+                self.send('250 OK')
+        elif cmd == 'QUIT':
+            self.send('221 Bye')
+            return False
+        elif cmd == 'PASV':
+            if self.passive is not None:
+                self.passive.close()
+            self.passive = socket.socket()
+            self.passive.bind(('127.0.0.1', 0))
+            self.passive.listen(1)
+            port = self.passive.getsockname()[1]
+            self.send(f'227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})')
+        elif cmd == 'SIZE':
+            self.send(f'213 {os.path.getsize(self.real_path(arg))}')
+        elif cmd in ('LIST', 'MLSD'):
+            self.send_listing(cmd, arg)
+        elif cmd == 'RETR':
+            with open(self.real_path(arg), 'rb') as f:
+                self.send('150 Opening data connection')
+                with self.open_data() as conn:
+                    while True:
+                        chunk = f.read(64 * 1024)
+                        if not chunk:
+                            break
+                        conn.sendall(chunk)
+            self.send('226 Transfer complete')
+        elif cmd == 'STOR':
+            with open(self.real_path(arg), 'wb') as f:
+                self.send('150 Opening data connection')
+                with self.open_data() as conn:
+                    while True:
+                        chunk = conn.recv(64 * 1024)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+            self.send('226 Transfer complete')
+        elif cmd == 'DELE':
+            os.remove(self.real_path(arg))
+            self.send('250 Deleted')
+        elif cmd == 'MKD':
+            os.mkdir(self.real_path(arg))
+            self.send(f'257 "{arg}" created')
+        elif cmd == 'RNFR':
+            if not os.path.exists(self.real_path(arg)):
+                self.send('550 No such file')
+            else:
+                self.rename_from = self.real_path(arg)
+                self.send('350 Ready for RNTO')
+        elif cmd == 'RNTO':
+            if not self.server.allow_rename:
+                self.send('502 Command not implemented')
+            elif self.rename_from is None:
+                self.send('503 Bad sequence of commands')
+            else:
+                os.replace(self.rename_from, self.real_path(arg))
+                self.rename_from = None
+                self.send('250 Renamed')
+        else:
+            self.send('502 Command not implemented')
+        return True
+
+    def send_listing(self, cmd, arg):
+        if cmd == 'MLSD' and not self.server.mlsd:
+            self.send('500 Unknown command')
+            return
+        path = self.real_path(arg or self.cwd)
+        lines = []
+        with os.scandir(path) as it:
+            for entry in sorted(it, key=lambda e: e.name):
+                st = entry.stat()
+                is_dir = stat.S_ISDIR(st.st_mode)
+                if cmd == 'MLSD':
+                    modify = datetime.fromtimestamp(st.st_mtime, timezone.utc).strftime('%Y%m%d%H%M%S')
+                    lines.append(f"type={'dir' if is_dir else 'file'};size={st.st_size};modify={modify}; {entry.name}")
+                else:
+                    lines.append(f"{'d' if is_dir else '-'}rwxr-xr-x 1 owner group {st.st_size:>10} Jan 01 12:00 {entry.name}")
+        self.send('150 Opening data connection')
+        with self.open_data() as conn:
+            conn.sendall(''.join(f"{line}\r\n" for line in lines).encode('utf-8'))
+        self.send('226 Transfer complete')
+
+class LocalFTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, latency=0.0, allow_rename=True, mlsd=True, host='127.0.0.1', port=0):
+        super().__init__((host, port), LocalFTPHandler)
+        self.root = root
+        self.latency = latency
+        self.allow_rename = allow_rename
+        self.mlsd = mlsd
+        self.commands = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def record(self, cmd):
+        with self._lock:
+            self.commands[cmd] = self.commands.get(cmd, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+import re
+from collections import namedtuple
+
+# Запись плейлиста RetroArch (.lpl):
+# system - каталог системы относительно base_content_directory (или None),
+# file_name - имя файла ROM без расширения, alias - имя внутри архива (после #) без расширения,
+# db_name - имя базы без .lpl, crc - CRC32 без суффикса |crc, path - исходный путь,
+# rom_path - путь к файлу ROM без части после #, label - отображаемое имя
+PlaylistEntry = namedtuple('PlaylistEntry', ['system', 'file_name', 'alias', 'db_name', 'crc', 'path', 'rom_path', 'label'])
+
+CHUNK_SIZE = 64 * 1024
+PATH_SEPARATORS = re.compile(r'[\\/]')
+
+def strip_extension(name):
+    # Отрезаем расширение по последней точке
+    return name.rsplit('.', 1)[0] if '.' in name else name
+
+def parse_entry(item, base_content_directory=None):
+    # Разбираем запись items в PlaylistEntry, возвращаем None для записей без пути
+    path = item.get('path', '') if isinstance(item, dict) else ''
+    if not path:
+        return None
+    rom_path, has_alias, inner = path.partition('#')
+    file_name = strip_extension(PATH_SEPARATORS.split(rom_path)[-1])
+    alias = strip_extension(inner) if has_alias else file_name
+    if not file_name or not alias:
+        return None
+
+    # Имя системы - первый каталог после base_content_directory
+    system = None
+    if base_content_directory:
+        base = base_content_directory.rstrip('/\\')
+        if rom_path.startswith(base) and rom_path[len(base):len(base) + 1] in ('/', '\\'):
+            parts = PATH_SEPARATORS.split(rom_path[len(base) + 1:])
+            if len(parts) >= 2 and parts[0]:
+                system = parts[0]
+
+    db_name = item.get('db_name') or ''
+    if db_name.endswith('.lpl'):
+        db_name = db_name[:-len('.lpl')]
+    crc = (item.get('crc32') or '').split('|', 1)[0]
+    return PlaylistEntry(system, file_name, alias, db_name, crc, path, rom_path, item.get('label', ''))
+
+class PlaylistReader:
+    # Потоковое чтение плейлиста: поля верхнего уровня до items сразу попадают в header,
+    # записи items разбираются по одной, не загружая весь файл в память.
+    # Поля после items дописываются в header по мере чтения
+    def __init__(self, source, chunk_size=CHUNK_SIZE):
+        self._own_file = isinstance(source, (str, os.PathLike))
+        if self._own_file:
+            self._file = open(source, 'r', encoding='utf-8-sig')
+        elif isinstance(source, io.TextIOBase):
+            self._file = source
+        else:
+            self._file = io.TextIOWrapper(source, encoding='utf-8-sig')
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._in_items = False
+        self._finished = False
+        self.header = {}
+        try:
+            self._expect('{')
+            self._parse_members(first=True)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._own_file:
+            self._file.close()
+
+    def __iter__(self):
+        # Возвращаем записи items как словари
+        if not self._in_items:
+            return
+        first = True
+        while True:
+            char = self._peek()
+            if char == ']':
+                self._pos += 1
+                break
+            if not first:
+                self._expect(',')
+            yield self._decode_value()
+            first = False
+        self._in_items = False
+        self._parse_members(first=False)
+
+    def entries(self):
+        # Возвращаем записи как PlaylistEntry. Если base_content_directory записан после items,
+        # дочитываем файл целиком, чтобы определить систему для каждой записи
+        items = iter(self)
+        if 'base_content_directory' not in self.header:
+            items = list(items)
+        base_content_directory = self.header.get('base_content_directory') or None
+        for item in items:
+            entry = parse_entry(item, base_content_directory)
+            if entry is not None:
+                yield entry
+
+    def _parse_members(self, first):
+        # Читаем пары ключ-значение объекта верхнего уровня до items или до конца объекта
+        while True:
+            char = self._peek()
+            if char == '}':
+                self._pos += 1
+                self._finished = True
+                return
+            if not first:
+                self._expect(',')
+            first = False
+            key = self._decode_value()
+            self._expect(':')
+            if key == 'items' and self._peek() == '[':
+                self._pos += 1
+                self._in_items = True
+                return
+            self.header[key] = self._decode_value()
+
+    def _fill(self):
+        # Дочитываем следующий блок, отбрасывая уже разобранную часть буфера
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        # Пропускаем пробелы и возвращаем следующий символ
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Неожиданный конец плейлиста")
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Ошибка разбора плейлиста: ожидался '{char}', найден '{found}'")
+        self._pos += 1
+
+    def _decode_value(self):
+        # Декодируем одно JSON значение; если оно обрывается на границе блока - дочитываем
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # Число в конце буфера может быть неполным
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+def read_playlist(source, chunk_size=CHUNK_SIZE):
+    # Читаем плейлист целиком: (поля верхнего уровня, список PlaylistEntry)
+    with PlaylistReader(source, chunk_size) as reader:
+        entries = list(reader.entries())
+        return reader.header, entries
@@ -1,10 +1,24 @@
 import os
-import re
 import argparse
+import atexit
+import difflib
 import glob
 import shutil
+import stat
+import errno
+import hashlib
+import multiprocessing
+import pickle
+import queue
+import re
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
-from collections import defaultdict
+
+from lpl_reader import PlaylistReader, read_playlist
 
 def setup_logging(filename):
     # Настраиваем файлы логов с временной меткой и именем входного файла
@@ -15,73 +29,78 @@ def setup_logging(filename):
     not_found_log_file = f"not_found_log_{timestamp}_{base_filename}.txt"
     return log_file, error_log_file, not_found_log_file
 
+# Фоновая запись логов: сообщения передаются через очередь, файлы открываются один раз
+# и сбрасываются на диск пачками. Поток записи создается заново в каждом процессе
+_log_queue = None
+_log_thread = None
+_log_pid = None
+_log_time = [0, '']
+
+def log_timestamp():
+    # Временная метка меняется раз в секунду, поэтому форматируем ее не чаще
+    now = int(time.time())
+    if now != _log_time[0]:
+        _log_time[:] = [now, datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')]
+    return _log_time[1]
+
+def log_writer(log_queue):
+    handles = {}
+    try:
+        running = True
+        while running:
+            batch = [log_queue.get()]
+            # Забираем все накопившиеся сообщения и пишем их одной пачкой
+            while True:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                filename, text = item
+                handle = handles.get(filename)
+                if handle is None:
+                    handle = handles[filename] = open(filename, 'a', encoding='utf-8')
+                handle.write(text)
+            for handle in handles.values():
+                handle.flush()
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+def write_log(filename, text):
+    global _log_queue, _log_thread, _log_pid
+    if _log_pid != os.getpid() or _log_thread is None or not _log_thread.is_alive():
+        _log_queue = queue.SimpleQueue()
+        _log_thread = threading.Thread(target=log_writer, args=(_log_queue,), daemon=True)
+        _log_thread.start()
+        _log_pid = os.getpid()
+    _log_queue.put((filename, text))
+
+def close_logging():
+    # Дописываем все сообщения из очереди и закрываем файлы логов
+    global _log_thread
+    if _log_thread is not None and _log_pid == os.getpid() and _log_thread.is_alive():
+        _log_queue.put(None)
+        _log_thread.join()
+    _log_thread = None
+
+atexit.register(close_logging)
+
 def log_message(log_file, message, error_log_file=None, not_found_log_file=None, is_error=False, is_not_found=False, console_output=True):
     # Записываем сообщение в соответствующий лог и, при необходимости, в консоль
+    text = f"{log_timestamp()}: {message}\n"
     if is_not_found and not_found_log_file:
-        with open(not_found_log_file, 'a', encoding='utf-8') as f:
-            f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {message}\n")
+        write_log(not_found_log_file, text)
     else:
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {message}\n")
+        write_log(log_file, text)
         if is_error and error_log_file:
-            with open(error_log_file, 'a', encoding='utf-8') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {message}\n")
+            write_log(error_log_file, text)
     if console_output:
         print(message)
 
-def extract_base_content_directory(input_file):
-    # Извлекаем base_content_directory из плейлиста
-    try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if '"base_content_directory"' in line:
-                    match = re.search(r'"base_content_directory":\s*"(.*?)"', line.strip())
-                    if match:
-                        return match.group(1)
-    except Exception as e:
-        return None
-    return None
-
-def extract_file_info(line, base_content_directory):
-    # Проверяем тип строки: с # или без #
-    if base_content_directory:
-        # Экранируем base_content_directory для использования в регулярном выражении
-        escaped_base = re.escape(base_content_directory)
-        if '#' in line:
-            # Строка с #: извлекаем имя файла, псевдоним и имя системы
-            pattern = rf'"path":\s*"{escaped_base}/([^/]+)/([^/]+?)\.[^/]+#(.+?)\.[^.]+"'
-            match = re.search(pattern, line)
-            if match:
-                system_name = match.group(1)  # Имя системы (nes)
-                file_name = match.group(2)    # Имя файла (до последней точки перед #)
-                alias = match.group(3)        # Псевдоним (до последней точки)
-                return file_name, alias, system_name
-        else:
-            # Строка без #: извлекаем имя файла, псевдоним = имя файла, имя системы
-            pattern = rf'"path":\s*"{escaped_base}/([^/]+)/([^/]+?)\.[^/]+"'
-            match = re.search(pattern, line)
-            if match:
-                system_name = match.group(1)  # Имя системы (nes)
-                file_name = match.group(2)    # Имя файла (до последней точки)
-                alias = file_name             # Псевдоним совпадает с именем файла
-                return file_name, alias, system_name
-    # Если base_content_directory не указан или строка не соответствует, используем старый метод
-    if '#' in line:
-        pattern = r'"path": ".*/([^/]+?)\.[^/]+#(.+?)\.[^.]+"'
-        match = re.search(pattern, line)
-        if match:
-            file_name = match.group(1)
-            alias = match.group(2)
-            return file_name, alias, None
-    else:
-        pattern = r'"path": ".*/([^/]+?)\.[^/]+"'
-        match = re.search(pattern, line)
-        if match:
-            file_name = match.group(1)
-            alias = file_name
-            return file_name, alias, None
-    return None, None, None
-
 def get_category_and_priority(directory):
     # Определяем категорию и приоритет на основе имени каталога
     dir_name = os.path.basename(directory).lower()
@@ -93,14 +112,347 @@ def get_category_and_priority(directory):
     }
     return categories.get(dir_name, (None, -1))
 
-def copy_png_files(input_file, search_dir, log_file, error_log_file, not_found_log_file):
-    # Инициализируем счетчики для статистики
-    stats = {
-        'lines_processed': 0,
+SCAN_CACHE_FILE = '.thumbnail_scan_cache.pickle'
+SCAN_CACHE_VERSION = 1
+
+def load_scan_cache(search_dir):
+    # Загружаем кэш сканирования из search_dir: {каталог: (mtime_ns, подкаталоги, PNG файлы)}
+    try:
+        with open(os.path.join(search_dir, SCAN_CACHE_FILE), 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') == SCAN_CACHE_VERSION:
+            return data['dirs']
+    except Exception:
+        pass
+    return {}
+
+def save_scan_cache(search_dir, cache):
+    # Сохраняем кэш атомарно, чтобы прерванный запуск не оставил поврежденный файл
+    cache_file = os.path.join(search_dir, SCAN_CACHE_FILE)
+    temp_file = f"{cache_file}.tmp"
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump({'version': SCAN_CACHE_VERSION, 'dirs': cache}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+        return True
+    except OSError:
+        return False
+
+def scan_tree(search_path, search_dir, cache, stats, rebuild=False):
+    # Обходим дерево в том же порядке, что и os.walk, перечитывая только каталоги,
+    # у которых изменилось время модификации. Ключи кэша - пути относительно search_dir.
+    # При rebuild перечитываются все каталоги search_path, записи других систем в кэше сохраняются
+    base_key = os.path.relpath(search_path, search_dir)
+    visited = set()
+    stack = [search_path]
+    while stack:
+        root = stack.pop()
+        key = os.path.relpath(root, search_dir)
+        try:
+            mtime = os.stat(root).st_mtime_ns
+        except OSError:
+            continue
+        cached = cache.get(key)
+        if not rebuild and cached is not None and cached[0] == mtime:
+            _, dirs, files = cached
+            stats['cache_hits'] += 1
+        else:
+            dirs, files = [], []
+            try:
+                with os.scandir(root) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            # Как и os.walk, не заходим в символические ссылки на каталоги
+                            if not entry.is_symlink():
+                                dirs.append(entry.name)
+                        elif entry.name.endswith('.png'):
+                            files.append(entry.name)
+            except OSError:
+                continue
+            cache[key] = (mtime, dirs, files)
+            stats['cache_misses'] += 1
+        visited.add(key)
+        yield root, files
+        stack.extend(os.path.join(root, d) for d in reversed(dirs))
+    # Удаляем из кэша каталоги, которых больше нет
+    prefix = '' if base_key == os.curdir else base_key + os.sep
+    for key in [k for k in cache if k not in visited and (k == base_key or k.startswith(prefix))]:
+        del cache[key]
+
+def build_thumbnail_index(tree):
+    # Строим индекс PNG файлов один раз для каталога поиска по результатам обхода (root, files):
+    # {категория: (отсортированные имена, записи)}, запись - (имя, порядок обхода, путь, приоритет)
+    index = {}
+    order = 0
+    for root, files in tree:
+        category, priority = get_category_and_priority(root)
+        if category is None:  # Пропускаем каталоги, не входящие в список
+            continue
+        entries = index.setdefault(category, ([], []))[1]
+        for file in files:
+            if file.endswith('.png'):
+                entries.append((file, order, os.path.join(root, file), priority))
+                order += 1
+    for category, (_, entries) in index.items():
+        entries.sort()
+        index[category] = ([entry[0] for entry in entries], entries)
+    return index
+
+def find_thumbnails(index, file_name):
+    # Ищем файлы, начинающиеся с file_name, бинарным поиском по отсортированным именам.
+    # Результат совпадает с полным обходом: категории в порядке обнаружения,
+    # файлы внутри категории отсортированы по приоритету (высший приоритет — последний)
+    matches = []
+    for category, (names, entries) in index.items():
+        found = []
+        i = bisect_left(names, file_name)
+        while i < len(names) and names[i].startswith(file_name):
+            _, order, path, priority = entries[i]
+            found.append((order, path, priority))
+            i += 1
+        if found:
+            found.sort()
+            matches.append((found[0][0], category, found))
+    matches.sort(key=lambda x: x[0])
+    files_by_category = {}
+    for _, category, found in matches:
+        files = [(path, priority) for _, path, priority in found]
+        files.sort(key=lambda x: x[1])
+        files_by_category[category] = files
+    return files_by_category
+
+# Режимы сопоставления записей плейлиста с PNG файлами:
+# prefix - имя файла начинается с имени ROM (исходное поведение),
+# normalized - совпадение нормализованных имен без тегов региона и пунктуации,
+# fuzzy - как normalized, а при отсутствии совпадения ближайшее имя через difflib
+MATCH_MODES = ('prefix', 'normalized', 'fuzzy')
+FUZZY_CUTOFF = 0.85
+FUZZY_MAX_CANDIDATES = 200
+
+TAG_RE = re.compile(r'\s*(\(([^)]*)\)|\[([^\]]*)\])')
+# Теги, различающие разные образы одной игры: (Disc 2), (Side B), (Part 1 of 2)
+KEEP_TAG_RE = re.compile(r'(disc|disk|side|part)\b', re.IGNORECASE)
+PUNCTUATION_RE = re.compile(r'[\W_]+')
+# Римские номера частей до XXXIX: с L, C, D и M совпадали бы обычные слова (Mix, MC, Sega CD)
+ROMAN_RE = re.compile(r'x{0,3}(ix|iv|v?i{0,3})')
+
+def strip_tag(match):
+    tag = match.group(2) if match.group(2) is not None else match.group(3)
+    return f" {tag}" if KEEP_TAG_RE.match(tag.strip()) else ''
+
+def normalize_name(name):
+    # Ключ для сравнения имен: без тегов (USA), [!] и т.п. (кроме номера диска и стороны),
+    # без учета регистра, любая пунктуация (в том числе замена RetroArch символов &*/:<>?\| на _)
+    # сводится к пробелу
+    if name.lower().endswith('.png'):
+        name = name[:-4]
+    return PUNCTUATION_RE.sub(' ', TAG_RE.sub(strip_tag, name)).casefold().strip()
+
+def number_tokens(key):
+    # Номера в ключе (арабские и римские): "street fighter iii" -> ('iii',).
+    # Нечеткий поиск сравнивает только ключи с одинаковыми номерами, иначе
+    # "Super Mario Bros" нашел бы "Super Mario Bros 3"
+    return tuple(token for token in key.split(' ') if token.isdigit() or (token and ROMAN_RE.fullmatch(token)))
+
+def bucket_key(key):
+    return key.split(' ', 1)[0], number_tokens(key)
+
+def build_match_index(index):
+    # Нормализованные ключи для всех PNG файлов индекса считаются один раз:
+    # ({ключ: [(категория, порядок, путь, приоритет, имя)]}, {(первое слово, номера): [ключи]})
+    keys = {}
+    for category, (_, entries) in index.items():
+        for name, order, path, priority in entries:
+            key = normalize_name(name)
+            if key:
+                keys.setdefault(key, []).append((category, order, path, priority, name))
+    buckets = {}
+    for key in keys:
+        buckets.setdefault(bucket_key(key), []).append(key)
+    return keys, buckets
+
+def find_fuzzy_key(match_index, key):
+    # Ближайший ключ среди ключей с тем же первым словом, теми же номерами и близкой длиной,
+    # не больше FUZZY_MAX_CANDIDATES
+    keys, buckets = match_index
+    limit = max(3, len(key) // 3)
+    candidates = [candidate for candidate in buckets.get(bucket_key(key), ())
+                  if abs(len(candidate) - len(key)) <= limit][:FUZZY_MAX_CANDIDATES]
+    close = difflib.get_close_matches(key, candidates, n=1, cutoff=FUZZY_CUTOFF)
+    return close[0] if close else None
+
+def find_thumbnails_normalized(match_index, file_name, fuzzy=False):
+    # Поиск по нормализованному ключу. Возвращает (файлы по категориям, найдено ли нечетко).
+    # Порядок как у find_thumbnails: категории в порядке обнаружения, внутри категории
+    # по приоритету, а при равном приоритете файл с точным именем - последний
+    keys, _ = match_index
+    key = normalize_name(file_name)
+    found = keys.get(key)
+    is_fuzzy = False
+    if not found and fuzzy and key:
+        fuzzy_key = find_fuzzy_key(match_index, key)
+        if fuzzy_key is not None:
+            found = keys[fuzzy_key]
+            is_fuzzy = True
+    files_by_category = {}
+    exact_name = f"{file_name}.png"
+    for category, order, path, priority, name in sorted(found or (), key=lambda x: x[1]):
+        files_by_category.setdefault(category, []).append((priority, name == exact_name, order, path))
+    for category, files in files_by_category.items():
+        files.sort()
+        files_by_category[category] = [(path, priority) for priority, _, _, path in files]
+    return files_by_category, is_fuzzy
+
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+FICLONE = 0x40049409  # ioctl клонирования файла (Linux: Btrfs, XFS)
+
+def file_hash(path):
+    # Считаем SHA-256 содержимого файла блоками
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def is_target_unchanged(old_path, new_path, link_mode, verify_hash):
+    # Проверяем, совпадает ли уже существующий целевой файл с источником
+    try:
+        target = os.lstat(new_path)
+    except OSError:
+        return False
+    if link_mode == 'symlink':
+        return stat.S_ISLNK(target.st_mode) and os.readlink(new_path) == os.path.abspath(old_path)
+    if stat.S_ISLNK(target.st_mode):
+        return False
+    source = os.stat(old_path)
+    if os.path.samestat(source, target):
+        return True
+    if link_mode == 'hardlink' or target.st_size != source.st_size:
+        return False
+    if verify_hash:
+        return file_hash(old_path) == file_hash(new_path)
+    # Допуск в 2 секунды: FAT/exFAT на SD-картах хранит время с такой точностью
+    return abs(target.st_mtime - source.st_mtime) < 2
+
+def reflink_file(old_path, new_path):
+    # Клонируем файл без копирования данных (copy-on-write), если ФС это поддерживает
+    import fcntl
+    with open(old_path, 'rb') as src, open(new_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(old_path, new_path)
+
+def place_file(old_path, new_path, link_mode):
+    # Размещаем файл в целевом пути выбранным способом, возвращаем 'copied' или 'linked'
+    if link_mode == 'copy':
+        # Не пишем через ссылку, оставшуюся от прошлого запуска, иначе испортим исходный файл
+        if os.path.islink(new_path) or (os.path.exists(new_path) and os.stat(new_path).st_nlink > 1):
+            os.remove(new_path)
+        shutil.copy2(old_path, new_path)
+        return 'copied'
+    if link_mode == 'hardlink':
+        # Цель уже является жесткой ссылкой на источник: os.replace поверх ссылки на тот же
+        # inode ничего не делает и оставил бы временный файл рядом с целевым
+        try:
+            if os.path.samestat(os.stat(old_path), os.lstat(new_path)):
+                return 'linked'
+        except OSError:
+            pass
+    # Ссылки создаем под временным именем и атомарно подменяем целевой файл
+    temp_path = f"{new_path}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    try:
+        if link_mode == 'hardlink':
+            os.link(old_path, temp_path)
+        elif link_mode == 'symlink':
+            os.symlink(os.path.abspath(old_path), temp_path)
+        else:
+            reflink_file(old_path, temp_path)
+    except (OSError, ImportError) as e:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        # reflink и hardlink между разными ФС недоступны - копируем обычным способом
+        if link_mode == 'reflink' or getattr(e, 'errno', None) == errno.EXDEV:
+            return place_file(old_path, new_path, 'copy')
+        raise
+    os.replace(temp_path, new_path)
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    return 'linked'
+
+def copy_files_to_target(ops, link_mode='copy', incremental=False, verify_hash=False):
+    # Размещаем источники в одном целевом файле последовательно (перезаписываем, если уже существует).
+    # В инкрементальном режиме результат определяет только последний источник (высший приоритет):
+    # предыдущие не размещаются ('superseded'), последний пропускается, если цель уже совпадает с ним.
+    # Возвращаем [(номер операции, 'copied' | 'linked' | 'skipped' | 'superseded' | None, ошибка или None)]
+    results = []
+    for i, (op_id, old_path, new_path) in enumerate(ops):
+        try:
+            if incremental and i < len(ops) - 1:
+                results.append((op_id, 'superseded', None))
+            elif incremental and is_target_unchanged(old_path, new_path, link_mode, verify_hash):
+                results.append((op_id, 'skipped', None))
+            else:
+                results.append((op_id, place_file(old_path, new_path, link_mode), None))
+        except OSError as e:
+            results.append((op_id, None, e))
+    return results
+
+def run_copy_tasks(copy_tasks, jobs, link_mode='copy', incremental=False, verify_hash=False):
+    # Выполняем задания {целевой путь: [(номер операции, источник)]} в пуле из jobs потоков.
+    # Возвращаем {номер операции: (результат, ошибка)}
+    task_ops = [[(op_id, old_path, new_path) for op_id, old_path in ops] for new_path, ops in copy_tasks.items()]
+    worker = partial(copy_files_to_target, link_mode=link_mode, incremental=incremental, verify_hash=verify_hash)
+    op_results = {}
+    if jobs > 1 and len(task_ops) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for results in executor.map(worker, task_ops):
+                op_results.update((op_id, (status, error)) for op_id, status, error in results)
+    else:
+        for ops in task_ops:
+            op_results.update((op_id, (status, error)) for op_id, status, error in worker(ops))
+    return op_results
+
+def new_stats():
+    # Счетчики для статистики
+    return {
+        'entries_processed': 0,
         'files_found': 0,
         'files_copied': 0,
-        'errors': 0
+        'files_linked': 0,
+        'files_skipped': 0,
+        'errors': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'fuzzy_matches': 0
     }
+
+def detect_system_name(input_file):
+    # Определяем систему по первой записи плейлиста, в которой она указана
+    with PlaylistReader(input_file) as reader:
+        for entry in reader.entries():
+            if entry.system:
+                return entry.system
+    return None
+
+def build_shared_indexes(search_dir, search_paths, rebuild_cache, stats):
+    # Строим индексы для нескольких каталогов поиска за один проход с общим кэшем сканирования
+    scan_cache = load_scan_cache(search_dir)
+    indexes = {}
+    for search_path in search_paths:
+        if os.path.isdir(search_path):
+            indexes[search_path] = build_thumbnail_index(scan_tree(search_path, search_dir, scan_cache, stats, rebuild_cache))
+    save_scan_cache(search_dir, scan_cache)
+    return indexes
+
+def copy_png_files(input_file, search_dir, log_file, error_log_file, not_found_log_file, rebuild_cache=False, jobs=1,
+                   link_mode='copy', incremental=False, verify_hash=False, indexes=None, match='prefix'):
+    # Инициализируем счетчики для статистики
+    stats = new_stats()
     
     # Проверяем, существует ли входной файл
     if not os.path.isfile(input_file):
@@ -120,26 +472,21 @@ def copy_png_files(input_file, search_dir, log_file, error_log_file, not_found_l
     # Получаем имя LPL файла без расширения
     lpl_name = os.path.splitext(os.path.basename(input_file))[0]
     
-    # Извлекаем base_content_directory
-    base_content_directory = extract_base_content_directory(input_file)
-    if base_content_directory:
-        log_message(log_file, f"Базовый путь: {base_content_directory}", console_output=True)
-    
-    # Извлекаем system_name из первой подходящей строки
-    system_name = None
+    # Читаем плейлист один раз как JSON
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            for line in lines:
-                if '"path"' in line:
-                    _, _, system_name = extract_file_info(line.strip(), base_content_directory)
-                    if system_name:
-                        break
+        header, entries = read_playlist(input_file)
     except Exception as e:
         log_message(log_file, f"Ошибка при чтении файла {input_file}: {e}", error_log_file, is_error=True, console_output=True)
         stats['errors'] += 1
         return stats
     
+    base_content_directory = header.get('base_content_directory')
+    if base_content_directory:
+        log_message(log_file, f"Базовый путь: {base_content_directory}", console_output=True)
+    
+    # Извлекаем system_name из первой подходящей записи
+    system_name = next((entry.system for entry in entries if entry.system), None)
+    
     # Определяем каталог для поиска
     search_path = search_dir
     if system_name:
@@ -152,61 +499,92 @@ def copy_png_files(input_file, search_dir, log_file, error_log_file, not_found_l
     else:
         log_message(log_file, f"Каталог поиска (система не определена): {search_path}", console_output=True)
     
-    # Читаем файл построчно для обработки
-    try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-    except Exception as e:
-        log_message(log_file, f"Ошибка при чтении файла {input_file}: {e}", error_log_file, is_error=True, console_output=True)
-        stats['errors'] += 1
-        return stats
-    
-    # Обрабатываем каждую строку
-    for line in lines:
-        stats['lines_processed'] += 1
-        file_name, alias, _ = extract_file_info(line.strip(), base_content_directory)
+    # Строим индекс PNG файлов один раз вместо обхода дерева для каждой записи,
+    # перечитывая с диска только измененные с прошлого запуска каталоги.
+    # В пакетном режиме индекс уже построен заранее и общий для всех плейлистов
+    if indexes is not None and search_path in indexes:
+        index = indexes[search_path]
+    else:
+        scan_cache = load_scan_cache(search_dir)
+        index = build_thumbnail_index(scan_tree(search_path, search_dir, scan_cache, stats, rebuild_cache))
+        if not save_scan_cache(search_dir, scan_cache):
+            log_message(log_file, f"Не удалось сохранить кэш сканирования в {search_dir}", console_output=True)
+
+    # Для нормализованного сопоставления ключи всех PNG файлов считаются один раз,
+    # после чего каждая запись ищется по словарю
+    match_index = build_match_index(index) if match != 'prefix' else None
+
+    # Этап сопоставления: для каждой записи находим PNG файлы и формируем задания копирования.
+    # Задания группируются по целевому файлу, чтобы копии в один файл выполнялись по порядку
+    # (высший приоритет — последний) даже при параллельном копировании
+    matched_entries = []
+    copy_tasks = {}
+    target_dirs = set()
+    op_count = 0
+    for entry in entries:
+        stats['entries_processed'] += 1
+        file_name, alias = entry.file_name, entry.alias
         if file_name and alias:
             # Собираем все подходящие файлы и группируем по категориям
-            files_by_category = defaultdict(list)
-            for root, _, files in os.walk(search_path):
-                category, priority = get_category_and_priority(root)
-                if category is None:  # Пропускаем каталоги, не входящие в список
+            if match == 'prefix':
+                files_by_category = find_thumbnails(index, file_name)
+            else:
+                files_by_category, is_fuzzy = find_thumbnails_normalized(match_index, file_name, match == 'fuzzy')
+                if is_fuzzy:
+                    stats['fuzzy_matches'] += 1
+            stats['files_found'] += sum(len(files) for files in files_by_category.values())
+            op_ids = []
+            for category, files in files_by_category.items():
+                for old_path, _ in files:
+                    # Формируем целевой путь
+                    new_dir = os.path.join(search_dir, 'retroarch', 'thumbnails', lpl_name, category)
+                    new_file = f"{alias}.png"
+                    new_path = os.path.join(new_dir, new_file)
+                    target_dirs.add(new_dir)
+                    copy_tasks.setdefault(new_path, []).append((op_count, old_path))
+                    op_ids.append(op_count)
+                    op_count += 1
+            matched_entries.append((entry.path, file_name, alias, op_ids))
+    
+    # Этап копирования: создаем каждый целевой каталог один раз и копируем в пуле потоков
+    for new_dir in target_dirs:
+        try:
+            os.makedirs(new_dir, exist_ok=True)
+        except OSError:
+            pass  # Ошибка будет зафиксирована при копировании файлов в этот каталог
+    op_results = run_copy_tasks(copy_tasks, jobs, link_mode, incremental, verify_hash)
+    
+    # Этап отчета: выводим результаты в порядке записей плейлиста
+    for path, file_name, alias, op_ids in matched_entries:
+        # Если файлы найдены, сообщаем о результате копирования
+        found = bool(op_ids)
+        copied = False
+        skipped = False
+        copy_result = "не скопирован"
+        
+        if found:
+            for op_id in op_ids:
+                status, error = op_results[op_id]
+                if status == 'superseded':
+                    # Источник перекрыт файлом с более высоким приоритетом для той же цели
                     continue
-                for file in files:
-                    if file.startswith(file_name) and file.endswith('.png'):
-                        stats['files_found'] += 1
-                        files_by_category[category].append((os.path.join(root, file), priority))
-            
-            # Если файлы найдены, копируем их по категориям
-            found = bool(files_by_category)
-            copied = False
-            copy_result = "не скопирован"
+                if status == 'skipped':
+                    stats['files_skipped'] += 1
+                    skipped = True
+                elif error is None:
+                    stats['files_copied' if status == 'copied' else 'files_linked'] += 1
+                    copied = True
+                else:
+                    stats['errors'] += 1
+                    log_message(log_file, f"{path}, {file_name}, {alias}, найден, не скопирован, Ошибка: {error}", error_log_file, is_error=True, console_output=True)
             
-            if found:
-                for category, files in files_by_category.items():
-                    # Сортируем файлы по приоритету (высший приоритет — последний)
-                    files.sort(key=lambda x: x[1])
-                    for old_path, _ in files:
-                        # Формируем целевой путь
-                        new_dir = os.path.join(search_dir, 'retroarch', 'thumbnails', lpl_name, category)
-                        new_file = f"{alias}.png"
-                        new_path = os.path.join(new_dir, new_file)
-                        
-                        try:
-                            # Создаем целевую директорию, если она не существует
-                            os.makedirs(new_dir, exist_ok=True)
-                            # Копируем файл (перезаписываем, если уже существует)
-                            shutil.copy2(old_path, new_path)
-                            stats['files_copied'] += 1
-                            copied = True
-                        except OSError as e:
-                            stats['errors'] += 1
-                            log_message(log_file, f"{line.strip()}, {file_name}, {alias}, найден, не скопирован, Ошибка: {e}", error_log_file, is_error=True, console_output=True)
-                
-                copy_result = "скопирован" if copied else copy_result
-                log_message(log_file, f"{line.strip()}, {file_name}, {alias}, найден, {copy_result}", console_output=False)
-            else:
-                log_message(log_file, f"{line.strip()}, {file_name}, {alias}, не найден, не скопирован", not_found_log_file=not_found_log_file, is_not_found=True, console_output=True)
+            if copied:
+                copy_result = "скопирован"
+            elif skipped:
+                copy_result = "не изменен"
+            log_message(log_file, f"{path}, {file_name}, {alias}, найден, {copy_result}", console_output=False)
+        else:
+            log_message(log_file, f"{path}, {file_name}, {alias}, не найден, не скопирован", not_found_log_file=not_found_log_file, is_not_found=True, console_output=True)
     
     return stats
 
@@ -214,19 +592,97 @@ def print_statistics(stats, log_file, error_log_file):
     # Формируем и выводим статистику
     stats_message = (
         "\n=== Статистика выполнения ===\n"
-        f"Обработано строк: {stats['lines_processed']}\n"
+        f"Обработано записей: {stats['entries_processed']}\n"
         f"Найдено PNG файлов: {stats['files_found']}\n"
         f"Успешно скопировано файлов: {stats['files_copied']}\n"
+        f"Создано ссылок: {stats['files_linked']}\n"
+        f"Пропущено без изменений: {stats['files_skipped']}\n"
         f"Ошибок: {stats['errors']}\n"
+        f"Кэш каталогов: попаданий {stats['cache_hits']}, промахов {stats['cache_misses']}\n"
+        f"Нечетких совпадений: {stats['fuzzy_matches']}\n"
         "==========================="
     )
     log_message(log_file, stats_message, console_output=True)
 
+# Индексы, общие для процессов пакетного режима (только чтение).
+# При запуске через fork наследуются без копирования (copy-on-write)
+_shared_indexes = None
+
+def init_batch_worker(indexes):
+    global _shared_indexes
+    _shared_indexes = indexes
+
+def process_playlist(lpl_file, search_dir, options):
+    # Обработка одного плейлиста в пакетном режиме со своими файлами логов
+    log_file, error_log_file, not_found_log_file = setup_logging(lpl_file)
+    log_message(log_file, f"Обработка файла: {lpl_file}", console_output=True)
+    try:
+        stats = copy_png_files(lpl_file, search_dir, log_file, error_log_file, not_found_log_file,
+                               indexes=_shared_indexes, **options)
+    except Exception as e:
+        log_message(log_file, f"Ошибка при обработке файла {lpl_file}: {e}", error_log_file, is_error=True, console_output=True)
+        stats = new_stats()
+        stats['errors'] += 1
+    print_statistics(stats, log_file, error_log_file)
+    close_logging()
+    return stats
+
+def run_batch(lpl_files, search_dir, options, workers):
+    # Пакетный режим: индекс строится один раз для всех плейлистов,
+    # плейлисты обрабатываются параллельно в пуле процессов
+    log_file, error_log_file, _ = setup_logging('batch')
+    index_stats = new_stats()
+    search_paths = set()
+    for lpl_file in lpl_files:
+        try:
+            system_name = detect_system_name(lpl_file)
+        except Exception:
+            system_name = None  # Ошибка чтения будет зафиксирована при обработке плейлиста
+        search_paths.add(os.path.join(search_dir, system_name) if system_name else search_dir)
+    log_message(log_file, f"Построение общего индекса для {len(search_paths)} каталогов...", console_output=True)
+    indexes = build_shared_indexes(search_dir, sorted(search_paths), options.get('rebuild_cache', False), index_stats)
+
+    if workers > 1 and len(lpl_files) > 1:
+        # Останавливаем поток записи логов перед fork, дочерние процессы запустят свой
+        close_logging()
+        mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                 initializer=init_batch_worker, initargs=(indexes,)) as executor:
+            futures = [executor.submit(process_playlist, lpl_file, search_dir, options) for lpl_file in lpl_files]
+            results = [(lpl_file, future.result()) for lpl_file, future in zip(lpl_files, futures)]
+    else:
+        init_batch_worker(indexes)
+        results = [(lpl_file, process_playlist(lpl_file, search_dir, options)) for lpl_file in lpl_files]
+
+    print_batch_statistics(results, index_stats, log_file, error_log_file)
+
+def print_batch_statistics(results, index_stats, log_file, error_log_file):
+    # Разбивка по плейлистам и общая статистика пакетного запуска
+    total = dict(index_stats)
+    lines = ["\n=== Статистика по плейлистам ==="]
+    for lpl_file, stats in results:
+        for key, value in stats.items():
+            total[key] += value
+        lines.append(
+            f"{os.path.basename(lpl_file)}: записей {stats['entries_processed']}, найдено {stats['files_found']}, "
+            f"скопировано {stats['files_copied']}, ссылок {stats['files_linked']}, "
+            f"без изменений {stats['files_skipped']}, ошибок {stats['errors']}"
+        )
+    log_message(log_file, "\n".join(lines), console_output=True)
+    print_statistics(total, log_file, error_log_file)
+
 def main():
     # Настраиваем парсер аргументов командной строки
     parser = argparse.ArgumentParser(description="Копирование PNG файлов на основе данных из файла")
-    parser.add_argument("--input_file", help="Путь к файлу со строками путей")
+    parser.add_argument("--input_file", help="Путь к файлу плейлиста (.lpl)")
     parser.add_argument("--search_dir", help="Путь к каталогу для поиска PNG файлов")
+    parser.add_argument("--rebuild_cache", action="store_true", help="Игнорировать кэш сканирования и перечитать весь каталог")
+    parser.add_argument("--jobs", type=int, default=4, help="Количество потоков копирования (по умолчанию 4)")
+    parser.add_argument("--incremental", action="store_true", help="Пропускать файлы, уже совпадающие с источником (размер и время изменения)")
+    parser.add_argument("--verify_hash", action="store_true", help="В инкрементальном режиме сравнивать содержимое по SHA-256 вместо времени изменения")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Количество процессов для пакетной обработки плейлистов")
+    parser.add_argument("--link_mode", choices=LINK_MODES, default='copy', help="Способ размещения файлов: копия, жесткая ссылка, reflink или символическая ссылка")
+    parser.add_argument("--match", choices=MATCH_MODES, default='prefix', help="Сопоставление картинок: по началу имени, по нормализованному имени или с нечетким поиском")
     
     # Получаем аргументы
     args = parser.parse_args()
@@ -236,20 +692,26 @@ def main():
     if args.input_file and args.search_dir:
         # Режим с параметрами командной строки
         log_file, error_log_file, not_found_log_file = setup_logging(args.input_file)
-        stats = copy_png_files(args.input_file, args.search_dir, log_file, error_log_file, not_found_log_file)
+        stats = copy_png_files(args.input_file, args.search_dir, log_file, error_log_file, not_found_log_file, args.rebuild_cache, max(1, args.jobs),
+                               args.link_mode, args.incremental, args.verify_hash, match=args.match)
         print_statistics(stats, log_file, error_log_file)
     else:
-        # Режим без параметров: поиск *.lpl файлов в текущем каталоге
-        lpl_files = glob.glob(os.path.join(current_dir, "*.lpl"))
+        # Режим без параметров: пакетная обработка *.lpl файлов в текущем каталоге
+        lpl_files = sorted(glob.glob(os.path.join(current_dir, "*.lpl")))
         if not lpl_files:
             print("В текущем каталоге не найдено *.lpl файлов")
             return
         
-        for lpl_file in lpl_files:
-            log_file, error_log_file, not_found_log_file = setup_logging(lpl_file)
-            log_message(log_file, f"Обработка файла: {lpl_file}", console_output=True)
-            stats = copy_png_files(lpl_file, current_dir, log_file, error_log_file, not_found_log_file)
-            print_statistics(stats, log_file, error_log_file)
+        options = {
+            'rebuild_cache': args.rebuild_cache,
+            'jobs': max(1, args.jobs),
+            'link_mode': args.link_mode,
+            'incremental': args.incremental,
+            'verify_hash': args.verify_hash,
+            'match': args.match
+        }
+        run_batch(lpl_files, current_dir, options, max(1, args.workers))
+    close_logging()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+from ftplib import FTP
+
+import pytest
+
+import delete_ftp_lpl_processor as processor
+from async_ftp import AsyncFTP
+from local_ftp_server import LocalFTPServer
+
+def write_file(root, path, data):
+    full_path = os.path.join(root, path.lstrip('/'))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as f:
+        f.write(data)
+
+def read_file(root, path):
+    with open(os.path.join(root, path.lstrip('/')), 'rb') as f:
+        return f.read()
+
+def exists(root, path):
+    return os.path.exists(os.path.join(root, path.lstrip('/')))
+
+@pytest.fixture
+def server_factory(tmp_path, monkeypatch):
+    # Сведения о возможностях серверов не должны переходить из теста в тест
+    monkeypatch.setattr(processor, '_mlsd_unsupported', set())
+    monkeypatch.setattr(processor, '_rename_unsupported', set())
+    servers = []
+
+    def start(**options):
+        root = tmp_path / 'ftp'
+        root.mkdir(exist_ok=True)
+        server = LocalFTPServer(str(root), **options).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+ENGINES = ['sync', 'async']
+
+def server_config(server, **options):
+    config = processor.get_config()
+    config.update(ftp_host='127.0.0.1', ftp_port=server.port, **options)
+    return config
+
+def engine_calls(server, engine, name, calls, known_dirs=False, **kwargs):
+    # Выполняем функцию движка (ftp_* или aftp_*) для каждого набора аргументов
+    # на одном соединении из пула выбранного движка
+    config = server_config(server)
+    if engine == 'sync':
+        if known_dirs:
+            kwargs['known_dirs'] = processor.KnownDirs()
+        pool = processor.FTPConnectionPool(config, 1)
+        try:
+            return [pool.call(getattr(processor, name), *args, **kwargs) for args in calls]
+        finally:
+            pool.close()
+
+    async def run_calls():
+        if known_dirs:
+            kwargs['known_dirs'] = processor.KnownDirs(asyncio.Lock)
+        pool = processor.AsyncFTPConnectionPool(config, 1)
+        try:
+            return [await pool.call(getattr(processor, f"a{name}"), *args, **kwargs) for args in calls]
+        finally:
+            await pool.close()
+    return asyncio.run(run_calls())
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_move_file_rename(server_factory, engine):
+    server = server_factory()
+    write_file(server.root, '/roms/nes/Game.zip', b'rom')
+    result = engine_calls(server, engine, 'ftp_move_file', [('/roms/nes/Game.zip', '/del/roms/nes/Game.zip')],
+                          known_dirs=True, dry_run=False)
+    assert result == [(3, 'rename')]
+    assert read_file(server.root, '/del/roms/nes/Game.zip') == b'rom'
+    assert not exists(server.root, '/roms/nes/Game.zip')
+    assert 'STOR' not in server.commands
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_move_file_copy_fallback(server_factory, engine):
+    server = server_factory(allow_rename=False)
+    for name in ('A', 'B'):
+        write_file(server.root, f'/roms/nes/{name}.zip', name.encode() * 100)
+    results = engine_calls(server, engine, 'ftp_move_file',
+                           [(f'/roms/nes/{name}.zip', f'/del/roms/nes/{name}.zip') for name in ('A', 'B')],
+                           known_dirs=True, dry_run=False, block_size=16)
+    assert results == [(100, 'copy'), (100, 'copy')]
+    for name in ('A', 'B'):
+        assert read_file(server.root, f'/del/roms/nes/{name}.zip') == name.encode() * 100
+        assert not exists(server.root, f'/roms/nes/{name}.zip')
+    # После ответа 502 на RNTO второй файл переносится без попытки переименования
+    assert server.commands['RNTO'] == 1
+    assert server.commands['MKD'] == 3
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_move_file_dry_run(server_factory, engine):
+    server = server_factory()
+    write_file(server.root, '/roms/nes/Game.zip', b'rom')
+    result = engine_calls(server, engine, 'ftp_move_file', [('/roms/nes/Game.zip', '/del/roms/nes/Game.zip')],
+                          dry_run=True)
+    assert result == [(3, 'dry-run')]
+    assert exists(server.root, '/roms/nes/Game.zip')
+    assert not exists(server.root, '/del')
+
+def drop_first_call(monkeypatch, owner, name, executed):
+    # Соединение рвется на первом вызове: executed - команда успела выполниться на сервере
+    # и потерялся только ответ, иначе команда до сервера не дошла
+    original = getattr(owner, name)
+    calls = []
+
+    def drop(args, kwargs):
+        calls.append(args)
+        return len(calls) == 1
+
+    if asyncio.iscoroutinefunction(original):
+        async def wrapper(*args, **kwargs):
+            if not drop(args, kwargs):
+                return await original(*args, **kwargs)
+            if executed:
+                await original(*args, **kwargs)
+            raise EOFError('connection lost')
+    else:
+        def wrapper(*args, **kwargs):
+            if not drop(args, kwargs):
+                return original(*args, **kwargs)
+            if executed:
+                original(*args, **kwargs)
+            raise EOFError('connection lost')
+    monkeypatch.setattr(owner, name, wrapper)
+    return calls
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('allow_rename, command, executed, method', [
+    (True, 'rename', True, 'rename'),
+    (True, 'rename', False, 'rename'),
+    (False, 'delete', True, 'copy'),
+    (False, 'delete', False, 'copy'),
+])
+def test_move_retried_after_drop(server_factory, monkeypatch, engine, allow_rename, command, executed, method):
+    server = server_factory(allow_rename=allow_rename)
+    write_file(server.root, '/roms/nes/Game.zip', b'rom')
+    calls = drop_first_call(monkeypatch, FTP if engine == 'sync' else AsyncFTP, command, executed)
+    result = engine_calls(server, engine, 'ftp_move_file', [('/roms/nes/Game.zip', '/del/roms/nes/Game.zip')],
+                          dry_run=False, size=3)
+    # Повтор либо выполняет команду заново, либо видит, что источника нет, а приемник на месте
+    assert calls
+    assert result == [(3, method)]
+    assert read_file(server.root, '/del/roms/nes/Game.zip') == b'rom'
+    assert not exists(server.root, '/roms/nes/Game.zip')
+
+@pytest.mark.parametrize('line, expected', [
+    ('-rw-r--r--   1 owner group      1024 Jan 01 12:00 Super Mario Bros. (World).zip',
+     ('Super Mario Bros. (World).zip', False, 1024)),
+    ('drwxr-xr-x 1 owner 0 Mar  5  2021 Named Boxarts', ('Named Boxarts', True, 0)),
+    ('lrwxrwxrwx 1 owner group 12 Jan 01 12:00 link.png -> target.png', ('link.png', False, 12)),
+    ('01-02-2023  03:04PM       <DIR>          Named_Snaps', ('Named_Snaps', True, 0)),
+    ('01-02-23  03:04       2048 Game  (Europe).zip', ('Game  (Europe).zip', False, 2048)),
+    ('total 12', None),
+])
+def test_parse_list_line(line, expected):
+    assert processor.parse_list_line(line) == expected
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('mlsd', [True, False])
+def test_list_dir(server_factory, engine, mlsd):
+    server = server_factory(mlsd=mlsd)
+    write_file(server.root, '/thumbs/Named_Boxarts/Game (USA).png', b'png')
+    listings = engine_calls(server, engine, 'ftp_list_dir', [('/thumbs',), ('/thumbs/Named_Boxarts',)])
+    assert listings[0][0][:2] == ('Named_Boxarts', True)
+    assert listings[1] == [('Game (USA).png', False, 3)]
+    # MLSD пробуется только один раз, дальше сразу LIST
+    assert server.commands.get('MLSD', 0) == (2 if mlsd else 1)
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_walk(server_factory, engine):
+    server = server_factory()
+    for path in ('/thumbs/Named_Boxarts/A.png', '/thumbs/Named_Boxarts/sub/B.png', '/thumbs/Named_Snaps/A.png'):
+        write_file(server.root, path, b'png')
+    [files] = engine_calls(server, engine, 'ftp_walk', [('/thumbs',)])
+    assert sorted(files) == [('/thumbs/Named_Boxarts/A.png', 3), ('/thumbs/Named_Boxarts/sub/B.png', 3),
+                             ('/thumbs/Named_Snaps/A.png', 3)]
+
+def make_playlist(root, count):
+    items = []
+    for i in range(count):
+        name = f"Game {i} (USA)"
+        write_file(root, f"/roms/nes/{name}.zip", os.urandom(100 + i))
+        write_file(root, f"/retroarch/thumbnails/Nintendo - NES/Named_Boxarts/{name}.png", b"png")
+        items.append({"path": f"/roms/nes/{name}.zip#{name}.nes", "label": name, "db_name": "Nintendo - NES.lpl"})
+    items.append({"path": "/roms/nes/Missing.zip", "label": "Missing", "db_name": "Nintendo - NES.lpl"})
+    write_file(root, processor.DELETE_PLAYLIST,
+               json.dumps({"version": "1.5", "base_content_directory": "/roms", "items": items}).encode())
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_journal_resume(server_factory, tmp_path, monkeypatch, engine):
+    server = server_factory()
+    make_playlist(server.root, 3)
+    config = server_config(server, engine=engine, dry_run=False, workers=2,
+                           journal_file=str(tmp_path / 'journal.jsonl'), stats_json=None)
+
+    # Обрыв при записи плейлиста: файлы уже перемещены, плейлист старый, журнал остается
+    def drop(*args, **kwargs):
+        raise OSError('connection lost')
+    with monkeypatch.context() as patch:
+        patch.setattr(processor, 'ftp_upload_atomic' if engine == 'sync' else 'aftp_upload_atomic', drop)
+        assert processor.run(dict(config)) == []
+    with open(tmp_path / 'journal.jsonl', encoding='utf-8') as f:
+        events = [json.loads(line) for line in f]
+    assert sum(event['event'] == 'item' for event in events) == 3
+    assert len(json.loads(read_file(server.root, processor.DELETE_PLAYLIST))['items']) == 4
+
+    server.commands.clear()
+    records = processor.run(dict(config))
+    totals = records[0]['totals']
+    assert totals['moved_roms'] == 3
+    assert totals['moved_thumbs'] == 3
+    assert totals['move_methods']['journal'] == 6
+    assert totals['total_roms_size'] == 100 + 101 + 102
+    # Повторно перемещаются только файлы, которых нет в журнале: таких нет
+    assert server.commands.get('RNTO', 0) == 1
+    assert not os.path.exists(tmp_path / 'journal.jsonl')
+    items = json.loads(read_file(server.root, processor.DELETE_PLAYLIST))['items']
+    assert [item['label'] for item in items] == ['Missing']
+    for i in range(3):
+        assert exists(server.root, f"/del/roms/nes/Game {i} (USA).zip")
+        assert exists(server.root, f"/del/retroarch/thumbnails/Nintendo - NES/Named_Boxarts/Game {i} (USA).png")
+
+def test_load_devices_cli_overrides(tmp_path):
+    path = tmp_path / 'devices.json'
+    path.write_text(json.dumps({
+        'defaults': {'workers': 8, 'engine': 'async'},
+        'devices': [{'name': 'switch 1', 'engine': 'sync'}, {'name': 'switch2', 'workers': 2}],
+    }), encoding='utf-8')
+    base_config = processor.get_config()
+    devices = processor.load_devices(str(path), base_config)
+    assert [(d['name'], d['engine'], d['workers']) for d in devices] == [('switch_1', 'sync', 8), ('switch2', 'async', 2)]
+    # Явно переданные флаги командной строки важнее значений из файла
+    devices = processor.load_devices(str(path), base_config, ['switch2'], {'workers': 4})
+    assert [(d['name'], d['engine'], d['workers']) for d in devices] == [('switch2', 'async', 4)]
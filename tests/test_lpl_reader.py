@@ -0,0 +1,49 @@
+import io
+import json
+
+import pytest
+
+from lpl_reader import PlaylistReader, parse_entry, read_playlist
+
+ITEMS = [
+    {"path": "/roms/nes/Super Mario Bros. (World).zip#Super Mario Bros. (World).nes", "label": "Super Mario Bros.",
+     "crc32": "3337EC46|crc", "db_name": "Nintendo - NES.lpl"},
+    {"path": "/roms/snes/Brace {\"quoted\"} [x].sfc", "label": "Экранированные \\ символы, 12345",
+     "crc32": "DETECT", "db_name": "Nintendo - SNES.lpl"},
+    {"path": "", "label": "Без пути"},
+    {"path": "C:\\roms\\gb\\Tetris (World).gb", "size": 1234567890, "db_name": "Nintendo - Game Boy.lpl"},
+]
+
+def playlist_text(base_after_items=False):
+    data = {"version": "1.5"}
+    if not base_after_items:
+        data["base_content_directory"] = "/roms"
+    data["items"] = ITEMS
+    if base_after_items:
+        data["base_content_directory"] = "/roms"
+    data["scan_dat_file_path"] = ""
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+# Маленькие блоки режут строки, числа и экранированные символы на границах чтения
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 64 * 1024])
+def test_items_across_chunk_boundaries(chunk_size):
+    with PlaylistReader(io.StringIO(playlist_text()), chunk_size) as reader:
+        assert reader.header == {"version": "1.5", "base_content_directory": "/roms"}
+        assert list(reader) == ITEMS
+        assert reader.header["scan_dat_file_path"] == ""
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 64 * 1024])
+def test_entries_with_base_after_items(chunk_size):
+    header, entries = read_playlist(io.BytesIO(playlist_text(base_after_items=True).encode('utf-8')), chunk_size)
+    expected = [parse_entry(item, "/roms") for item in ITEMS]
+    assert entries == [entry for entry in expected if entry is not None]
+    assert entries[0].system == 'nes'
+    assert entries[0].alias == 'Super Mario Bros. (World)'
+    assert entries[0].crc == '3337EC46'
+    assert header["base_content_directory"] == "/roms"
+
+def test_truncated_playlist():
+    text = playlist_text()[:-40]
+    with pytest.raises(ValueError):
+        with PlaylistReader(io.StringIO(text), 3) as reader:
+            list(reader)
@@ -0,0 +1,258 @@
+import json
+import os
+from collections import defaultdict
+
+import pytest
+
+from rename_png_files import (build_match_index, build_thumbnail_index, copy_files_to_target, copy_png_files,
+                              find_thumbnails, find_thumbnails_normalized, get_category_and_priority,
+                              is_target_unchanged, new_stats, normalize_name, number_tokens, place_file, scan_tree)
+
+def match_index(names, directory='/thumbs/boxart'):
+    return build_match_index(build_thumbnail_index([(directory, names)]))
+
+def found_names(files_by_category):
+    return {category: [path.rsplit('/', 1)[1] for path, _ in files] for category, files in files_by_category.items()}
+
+def test_normalize_name():
+    assert normalize_name('Sonic & Knuckles (USA).png') == 'sonic knuckles'
+    assert normalize_name('Sonic _ Knuckles (USA) [!]') == 'sonic knuckles'
+    assert normalize_name('Final Fantasy VII (USA) (Disc 2)') == 'final fantasy vii disc 2'
+    assert normalize_name('Ghost Hunter (Europe) (Side B).png') == 'ghost hunter side b'
+
+@pytest.mark.parametrize('key, numbers', [
+    ('street fighter iii', ('iii',)),
+    ('mega man x', ('x',)),
+    ('final fantasy vii disc 2', ('vii', '2')),
+    ('super mario bros 3', ('3',)),
+    ('dance dance revolution mix', ()),
+    ('mc kids', ()),
+    ('sega cd classics', ()),
+    ('civilization', ()),
+])
+def test_number_tokens(key, numbers):
+    assert number_tokens(key) == numbers
+
+# RetroArch заменяет &*/:<>?\| в именах миниатюр на _
+@pytest.mark.parametrize('fuzzy', [False, True])
+def test_ampersand_replaced_by_underscore(fuzzy):
+    index = match_index(['Sonic _ Knuckles (USA).png', 'Sonic the Hedgehog (USA).png'])
+    files, is_fuzzy = find_thumbnails_normalized(index, 'Sonic & Knuckles (World)', fuzzy)
+    assert found_names(files) == {'Named_Boxarts': ['Sonic _ Knuckles (USA).png']}
+    assert not is_fuzzy
+
+@pytest.mark.parametrize('fuzzy', [False, True])
+def test_prefix_of_longer_title_not_matched(fuzzy):
+    index = match_index(['Super Mario Bros 3 (USA).png', 'Mario Bros 3.png'])
+    assert find_thumbnails_normalized(index, 'Super Mario Bros. (World)', fuzzy) == ({}, False)
+    assert find_thumbnails_normalized(index, 'Mario', fuzzy) == ({}, False)
+
+@pytest.mark.parametrize('fuzzy', [False, True])
+def test_disc_and_side_tags_kept(fuzzy):
+    index = match_index(['Final Fantasy VII (USA) (Disc 1).png', 'Final Fantasy VII (USA) (Disc 2).png',
+                         'Ghost Hunter (Europe) (Side A).png', 'Ghost Hunter (Europe) (Side B).png'])
+    files, _ = find_thumbnails_normalized(index, 'Final Fantasy VII (Europe) (Disc 2)', fuzzy)
+    assert found_names(files) == {'Named_Boxarts': ['Final Fantasy VII (USA) (Disc 2).png']}
+    files, _ = find_thumbnails_normalized(index, 'Ghost Hunter (Side A)', fuzzy)
+    assert found_names(files) == {'Named_Boxarts': ['Ghost Hunter (Europe) (Side A).png']}
+    assert find_thumbnails_normalized(index, 'Final Fantasy VII (USA) (Disc 3)', fuzzy) == ({}, False)
+
+def test_fuzzy_rejects_other_part_number():
+    index = match_index(['Street Fighter III (Japan).png', 'Final Fantasy IV (USA).png'])
+    assert find_thumbnails_normalized(index, 'Street Fighter II (USA)', fuzzy=True) == ({}, False)
+    assert find_thumbnails_normalized(index, 'Final Fantasy VI (USA)', fuzzy=True) == ({}, False)
+
+def test_fuzzy_matches_close_name():
+    index = match_index(['Street Fighter II (USA).png', 'Streets of Rage 2 (USA).png'])
+    files, is_fuzzy = find_thumbnails_normalized(index, 'Street Figher II (USA)', fuzzy=True)
+    assert found_names(files) == {'Named_Boxarts': ['Street Fighter II (USA).png']}
+    assert is_fuzzy
+    assert find_thumbnails_normalized(index, 'Street Figher II (USA)') == ({}, False)
+
+def test_fuzzy_ignores_words_that_look_roman():
+    index = match_index(['Dance Dance Revolution Max (Japan).png'])
+    files, is_fuzzy = find_thumbnails_normalized(index, 'Dance Dance Revolution Mix', fuzzy=True)
+    assert found_names(files) == {'Named_Boxarts': ['Dance Dance Revolution Max (Japan).png']}
+    assert is_fuzzy
+
+TREE = [
+    ('/thumbs/nes/screenshot', ['Contra (USA).png', 'Metroid (USA).png']),
+    ('/thumbs/nes/other', ['Contra (USA).png']),
+    ('/thumbs/nes/boxart', ['Contra (USA).png', 'Metroid (USA).png']),
+    ('/thumbs/nes/cartridge', ['Contra (USA).png']),
+    ('/thumbs/nes/art', ['Metroid (USA).png', 'Contra (USA).png']),
+]
+
+# При точных именах normalized дает тот же порядок, что и prefix: категории в порядке
+# обнаружения, внутри категории по приоритету (высший приоритет - последний)
+@pytest.mark.parametrize('file_name', ['Contra (USA)', 'Metroid (USA)'])
+def test_normalized_order_matches_prefix(file_name):
+    index = build_thumbnail_index(TREE)
+    files, _ = find_thumbnails_normalized(build_match_index(index), file_name)
+    assert files == find_thumbnails(index, file_name)
+
+def test_normalized_order_contra():
+    files, _ = find_thumbnails_normalized(build_match_index(build_thumbnail_index(TREE)), 'Contra (USA)')
+    assert [(category, [path for path, _ in paths]) for category, paths in files.items()] == [
+        ('Named_Titles', ['/thumbs/nes/cartridge/Contra (USA).png', '/thumbs/nes/screenshot/Contra (USA).png']),
+        ('Named_Boxarts', ['/thumbs/nes/boxart/Contra (USA).png']),
+        ('Named_Snaps', ['/thumbs/nes/art/Contra (USA).png']),
+    ]
+
+# При равном приоритете файл с точным именем размещается последним и перекрывает остальные
+def test_normalized_exact_name_last():
+    index = match_index(['Contra (USA).png', 'Contra (Europe).png', 'Contra.png'])
+    files, _ = find_thumbnails_normalized(index, 'Contra (USA)')
+    assert found_names(files) == {'Named_Boxarts': ['Contra (Europe).png', 'Contra.png', 'Contra (USA).png']}
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+def tmp_files(directory):
+    return [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+# Исходный поиск: полный обход os.walk для каждой записи плейлиста
+def walk_thumbnails(search_path, file_name):
+    files_by_category = defaultdict(list)
+    for root, _, files in os.walk(search_path):
+        category, priority = get_category_and_priority(root)
+        if category is None:
+            continue
+        for file in files:
+            if file.startswith(file_name) and file.endswith('.png'):
+                files_by_category[category].append((os.path.join(root, file), priority))
+    for files in files_by_category.values():
+        files.sort(key=lambda x: x[1])
+    return dict(files_by_category)
+
+def test_find_thumbnails_matches_walk(tmp_path):
+    search_path = str(tmp_path / 'nes')
+    names = ['Contra (USA).png', 'Contra Force (USA).png', 'Contra.png', 'Metroid (USA).png', 'Metroid.txt']
+    for directory in ['screenshot', 'art', 'other', 'boxart', 'cartridge', 'hacks/boxart', 'hacks/art/screenshot']:
+        for i, name in enumerate(names):
+            if (i + len(directory)) % 3:
+                write_file(os.path.join(search_path, directory, name), directory)
+    cache = {}
+    for _ in range(2):
+        stats = new_stats()
+        index = build_thumbnail_index(scan_tree(search_path, str(tmp_path), cache, stats))
+        for file_name in ['Contra', 'Contra (USA)', 'Contra Force', 'Metroid', 'Metroid.', 'Zelda', '']:
+            assert find_thumbnails(index, file_name) == walk_thumbnails(search_path, file_name)
+    assert stats['cache_misses'] == 0 and stats['cache_hits'] > 0
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'src' / 'Contra (USA).png')
+    write_file(path, 'source')
+    return path
+
+@pytest.mark.parametrize('link_mode', ['copy', 'hardlink', 'symlink'])
+def test_place_file_modes(tmp_path, source, link_mode):
+    target_dir = tmp_path / 'target'
+    target_dir.mkdir()
+    target = str(target_dir / 'Contra.png')
+    expected = 'copied' if link_mode == 'copy' else 'linked'
+    for _ in range(2):
+        assert place_file(source, target, link_mode) == expected
+        assert read_file(target) == 'source'
+        assert os.path.islink(target) == (link_mode == 'symlink')
+        assert os.path.samefile(source, target) == (link_mode != 'copy')
+        assert tmp_files(target_dir) == []
+    if link_mode == 'symlink':
+        assert os.readlink(target) == os.path.abspath(source)
+
+# Копирование поверх ссылки от прошлого запуска не должно менять исходный файл
+@pytest.mark.parametrize('link_mode', ['hardlink', 'symlink'])
+def test_copy_replaces_stale_link(tmp_path, source, link_mode):
+    other = str(tmp_path / 'src' / 'Contra (Europe).png')
+    write_file(other, 'other')
+    target = str(tmp_path / 'Contra.png')
+    place_file(source, target, link_mode)
+    assert place_file(other, target, 'copy') == 'copied'
+    assert read_file(source) == 'source'
+    assert read_file(target) == 'other'
+    assert not os.path.islink(target) and os.stat(target).st_nlink == 1
+
+def test_is_target_unchanged(tmp_path, source):
+    target = str(tmp_path / 'Contra.png')
+    assert not is_target_unchanged(source, target, 'copy', False)
+    place_file(source, target, 'copy')
+    assert is_target_unchanged(source, target, 'copy', False)
+    assert is_target_unchanged(source, target, 'copy', True)
+    assert not is_target_unchanged(source, target, 'hardlink', False)
+    assert not is_target_unchanged(source, target, 'symlink', False)
+    # Тот же размер и время, другое содержимое: замечает только проверка хеша
+    stat = os.stat(target)
+    write_file(target, 'SOURCE')
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert is_target_unchanged(source, target, 'copy', False)
+    assert not is_target_unchanged(source, target, 'copy', True)
+    os.utime(target, (stat.st_atime, stat.st_mtime + 10))
+    assert not is_target_unchanged(source, target, 'copy', False)
+    write_file(target, 'longer source')
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert not is_target_unchanged(source, target, 'copy', False)
+
+    place_file(source, target, 'hardlink')
+    assert is_target_unchanged(source, target, 'hardlink', False)
+    assert is_target_unchanged(source, target, 'copy', False)
+    place_file(source, target, 'symlink')
+    assert is_target_unchanged(source, target, 'symlink', False)
+    assert not is_target_unchanged(source, target, 'hardlink', False)
+    assert not is_target_unchanged(source, target, 'copy', False)
+    os.remove(target)
+    os.symlink(source + '.old', target)
+    assert not is_target_unchanged(source, target, 'symlink', False)
+
+@pytest.mark.parametrize('link_mode', ['copy', 'hardlink', 'symlink'])
+def test_copy_files_to_target_incremental(tmp_path, source, link_mode):
+    other = str(tmp_path / 'src' / 'Contra (Europe).png')
+    write_file(other, 'other')
+    target = str(tmp_path / 'Contra.png')
+    ops = [(0, source, target), (1, other, target)]
+    placed = 'copied' if link_mode == 'copy' else 'linked'
+    assert copy_files_to_target(ops, link_mode) == [(0, placed, None), (1, placed, None)]
+    assert read_file(target) == 'other'
+    assert copy_files_to_target(ops, link_mode, incremental=True) == [(0, 'superseded', None), (1, 'skipped', None)]
+    os.remove(target)
+    assert copy_files_to_target(ops, link_mode, incremental=True) == [(0, 'superseded', None), (1, placed, None)]
+    assert read_file(target) == 'other'
+    assert read_file(source) == 'source'
+    assert tmp_files(str(tmp_path)) == []
+
+def test_copy_files_to_target_error(tmp_path, source):
+    target = str(tmp_path / 'Contra.png')
+    results = copy_files_to_target([(0, str(tmp_path / 'missing.png'), target), (1, source, target)])
+    assert results[0][:2] == (0, None) and isinstance(results[0][2], OSError)
+    assert results[1] == (1, 'copied', None)
+
+# Перекрытые источники не считаются ни пропущенными, ни скопированными
+def test_copy_png_files_incremental_stats(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for directory in ['boxart', 'cartridge', 'screenshot']:
+        write_file(str(tmp_path / 'nes' / directory / 'Contra (USA).png'), directory)
+    write_file(str(tmp_path / 'nes' / 'boxart' / 'Metroid (USA).png'), 'boxart')
+    input_file = str(tmp_path / 'Nintendo - NES.lpl')
+    items = [{"path": f"/roms/nes/{name} (USA).zip", "label": name, "db_name": "Nintendo - NES.lpl"}
+             for name in ['Contra', 'Metroid', 'Zelda']]
+    with open(input_file, 'w') as f:
+        json.dump({"version": "1.5", "base_content_directory": "/roms", "items": items}, f)
+
+    def run():
+        return copy_png_files(input_file, str(tmp_path), 'log.txt', 'errors.txt', 'not_found.txt',
+                              link_mode='hardlink', incremental=True)
+
+    stats = run()
+    assert (stats['files_found'], stats['files_linked'], stats['files_skipped'], stats['errors']) == (4, 3, 0, 0)
+    stats = run()
+    assert (stats['files_found'], stats['files_linked'], stats['files_skipped'], stats['errors']) == (4, 0, 3, 0)
+    titles = tmp_path / 'retroarch' / 'thumbnails' / 'Nintendo - NES' / 'Named_Titles'
+    assert os.listdir(titles) == ['Contra (USA).png']
+    assert read_file(str(titles / 'Contra (USA).png')) == 'screenshot'
+    assert os.path.samefile(titles / 'Contra (USA).png', tmp_path / 'nes' / 'screenshot' / 'Contra (USA).png')